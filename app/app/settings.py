@@ -152,6 +152,12 @@ REST_FRAMEWORK = {
     'SEARCH_PARAM': 'q',
 }
 
+# Seconds for which document counts of cursor paginated lists are reused
+DOCUMENT_COUNT_CACHE_SECONDS = 60
+
+# Seconds for which documents handed out by the work queue stay reserved for an annotator
+WORK_LEASE_SECONDS = 600
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.0/topics/i18n/
 
@@ -188,6 +194,47 @@ SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 # on the import phase
 IMPORT_BATCH_SIZE = 500
 
+# Directory where uploads are staged until the import worker
+# (`manage.py import_worker`) picks them up
+IMPORT_STAGING_DIR = os.getenv('IMPORT_STAGING_DIR', os.path.join(BASE_DIR, 'imports'))
+
+# Seconds after which a running import that stopped reporting progress is
+# taken to be abandoned by a crashed worker, and resumed by another one
+IMPORT_STALE_SECONDS = 600
+
+# Number of processes parsing JSONL uploads, and the file size
+# below which they are parsed serially
+IMPORT_PARSE_WORKERS = int(os.getenv('IMPORT_PARSE_WORKERS', os.cpu_count() or 1))
+IMPORT_PARALLEL_MIN_BYTES = int(os.getenv('IMPORT_PARALLEL_MIN_BYTES', 16 * 1024 * 1024))
+
+# Default and largest chunk sizes of chunked uploads
+IMPORT_CHUNK_SIZE = 8 * 1024 * 1024
+IMPORT_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Seconds after which chunked uploads that were never finalized, and
+# received no chunk since, are removed by the import worker
+IMPORT_UPLOAD_EXPIRY_SECONDS = 24 * 60 * 60
+
+# Number of documents fetched per query when exporting
+EXPORT_BATCH_SIZE = 1000
+
+# Number of documents labeled per batch by `manage.py preannotate`
+PREANNOTATION_BATCH_SIZE = 1000
+
+# Directory where `manage.py preannotate --incremental` keeps the classifiers
+# it trains between runs
+CLASSIFIER_CHECKPOINT_DIR = os.getenv('CLASSIFIER_CHECKPOINT_DIR', os.path.join(BASE_DIR, 'classifiers'))
+
+# Downloads are served from snapshots kept in this directory, which are
+# refreshed in the background by `manage.py refresh_exports`
+EXPORT_SNAPSHOTS = os.environ.get('EXPORT_SNAPSHOTS') != 'False'
+EXPORT_SNAPSHOT_DIR = os.getenv('EXPORT_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'exports'))
+
+# Seconds a snapshot stays stale before `manage.py refresh_exports` rewrites it,
+# so that snapshots of projects being annotated are rewritten at most this often.
+# Downloads refresh stale snapshots right away.
+EXPORT_REFRESH_DELAY_SECONDS = int(os.getenv('EXPORT_REFRESH_DELAY_SECONDS', 300))
+
 GOOGLE_TRACKING_ID = os.getenv('GOOGLE_TRACKING_ID', 'UA-125643874-2')
 
 AZURE_APPINSIGHTS_IKEY = os.getenv('AZURE_APPINSIGHTS_IKEY')
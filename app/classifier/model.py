@@ -3,10 +3,18 @@ Baseline model.
 """
 
 from sklearn.calibration import CalibratedClassifierCV
+from sklearn.linear_model import SGDClassifier
 from sklearn.svm import LinearSVC
 
 
-def build_model():
-    estimator = CalibratedClassifierCV(base_estimator=LinearSVC())
+def build_model(cv=3):
+    estimator = CalibratedClassifierCV(base_estimator=LinearSVC(), cv=cv)
+
+    return estimator
+
+
+def build_online_model():
+    # logistic regression trained with partial_fit, one batch of new labels at a time
+    estimator = SGDClassifier(loss='log')
 
     return estimator
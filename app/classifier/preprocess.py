@@ -1,10 +1,14 @@
 """
 Preprocessor.
 """
-import MeCab
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 
-t = MeCab.Tagger('-Owakati')
+try:
+    import MeCab
+except ImportError:
+    MeCab = None
+
+t = MeCab.Tagger('-Owakati') if MeCab else None
 
 
 def tokenize(text):
@@ -22,6 +26,15 @@ def tokenize(text):
 
 
 def build_vectorizer():
-    vectorizer = TfidfVectorizer(tokenizer=tokenize)
+    # Without MeCab, texts are split into words the scikit-learn way.
+    vectorizer = TfidfVectorizer(tokenizer=tokenize if t else None)
+
+    return vectorizer
+
+
+def build_hashing_vectorizer():
+    # Stateless, so that documents are vectorized the same way in every run
+    # without refitting on the whole corpus.
+    vectorizer = HashingVectorizer(tokenizer=tokenize if t else None, n_features=2 ** 18, alternate_sign=False)
 
     return vectorizer
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Label, Document, Project
+from .models import Label, Document, Project, ImportJob, ChunkedUpload, ExportSnapshot, AnnotationCounter, \
+    WorkItem, ClassifierCheckpoint
 from .models import DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation
 
 admin.site.register(DocumentAnnotation)
@@ -9,3 +10,9 @@ admin.site.register(Seq2seqAnnotation)
 admin.site.register(Label)
 admin.site.register(Document)
 admin.site.register(Project)
+admin.site.register(ImportJob)
+admin.site.register(ChunkedUpload)
+admin.site.register(ExportSnapshot)
+admin.site.register(AnnotationCounter)
+admin.site.register(WorkItem)
+admin.site.register(ClassifierCheckpoint)
@@ -1,17 +1,32 @@
+import hashlib
 from collections import Counter
-from itertools import chain
+from io import BytesIO
 
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, Sum, prefetch_related_objects
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.functional import cached_property
+from django.utils.http import parse_etags
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, generics, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Project, Label, Document
-from .permissions import IsAdminUserAndWriteOnly, IsProjectUser, IsOwnAnnotation
-from .serializers import ProjectSerializer, LabelSerializer
+from .importers import ImportFileError, save_chunk, assemble_chunks
+from .models import Project, Label, Document, ImportJob, ChunkedUpload, AnnotationCounter, \
+    DocumentCompletion, ExportSnapshot, WorkItem
+from .pagination import DocumentCursorPagination, DocumentWindowPagination
+from .search import DocumentSearchFilter
+from .permissions import IsAdminUserAndWriteOnly, IsProjectUser, IsOwnAnnotation, get_project
+from .serializers import ProjectSerializer, LabelSerializer, ImportJobSerializer, ChunkedUploadSerializer, \
+    AnnotationBulkSerializer
 
 
 class ProjectViewSet(viewsets.ModelViewSet):
@@ -28,6 +43,20 @@ class ProjectViewSet(viewsets.ModelViewSet):
         project = self.get_object()
         return Response(project.get_progress(self.request.user))
 
+    @action(methods=['get'], detail=False, url_path='progress')
+    def progress_list(self, request):
+        # progress of every project of the user, with one grouped query per table
+        projects = self.get_queryset().all()
+        totals = dict(Document.objects.filter(project__in=projects).order_by()
+                                      .values_list('project').annotate(Count('id')))
+        completed = dict(DocumentCompletion.objects.filter(project__in=projects, user=request.user).order_by()
+                                                   .values_list('project').annotate(Count('id')))
+        response = {project_id: {'total': totals.get(project_id, 0),
+                                 'remaining': totals.get(project_id, 0) - completed.get(project_id, 0)}
+                    for project_id in projects.values_list('id', flat=True)}
+
+        return Response(response)
+
 
 class LabelList(generics.ListCreateAPIView):
     queryset = Label.objects.all()
@@ -41,7 +70,7 @@ class LabelList(generics.ListCreateAPIView):
         return queryset
 
     def perform_create(self, serializer):
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        project = get_project(self.request, self.kwargs['project_id'])
         serializer.save(project=project)
 
 
@@ -50,21 +79,19 @@ class ProjectStatsAPI(APIView):
     permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUserAndWriteOnly)
 
     def get(self, request, *args, **kwargs):
-        p = get_object_or_404(Project, pk=self.kwargs['project_id'])
-        labels = [label.text for label in p.labels.all()]
-        users = [user.username for user in p.users.all()]
-        docs = [doc for doc in p.documents.all()]
-        nested_labels = [[a.label.text for a in doc.get_annotations()] for doc in docs]
-        nested_users = [[a.user.username for a in doc.get_annotations()] for doc in docs]
+        p = get_project(self.request, self.kwargs['project_id'])
+        counters = AnnotationCounter.objects.filter(project=p).order_by()
+        label_names = list(p.labels.values_list('id', 'text'))
+        user_names = list(p.users.values_list('id', 'username'))
 
-        label_count = Counter(chain(*nested_labels))
-        label_data = [label_count[name] for name in labels]
+        # read from the counters maintained on annotation writes instead of scanning annotations
+        label_count = dict(counters.values_list('label').annotate(Sum('count')))
+        user_count = dict(counters.values_list('user').annotate(Sum('count')))
 
-        user_count = Counter(chain(*nested_users))
-        user_data = [user_count[name] for name in users]
-
-        response = {'label': {'labels': labels, 'data': label_data},
-                    'user': {'users': users, 'data': user_data}}
+        response = {'label': {'labels': [name for _, name in label_names],
+                              'data': [label_count.get(pk, 0) for pk, _ in label_names]},
+                    'user': {'users': [name for _, name in user_names],
+                             'data': [user_count.get(pk, 0) for pk, _ in user_names]}}
 
         return Response(response)
 
@@ -89,56 +116,270 @@ class LabelDetail(generics.RetrieveUpdateDestroyAPIView):
 
 class DocumentList(generics.ListCreateAPIView):
     queryset = Document.objects.all()
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter)
+    filter_backends = (DjangoFilterBackend, filters.OrderingFilter, DocumentSearchFilter)
     search_fields = ('text', )
+    ordering = ('id', )
     permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUserAndWriteOnly)
 
+    @property
+    def paginator(self):
+        # documents are paged by id when a cursor is given, even an empty one
+        if not hasattr(self, '_paginator'):
+            if DocumentCursorPagination.cursor_query_param in self.request.query_params:
+                self._paginator = DocumentCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @cached_property
+    def project(self):
+        return get_project(self.request, self.kwargs['project_id'])
+
     def get_serializer_class(self):
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
-        self.serializer_class = project.get_document_serializer()
+        self.serializer_class = self.project.get_document_serializer()
 
         return self.serializer_class
 
     def get_queryset(self):
         queryset = self.queryset.filter(project=self.kwargs['project_id'])
+        if self.request.method == 'GET':
+            queryset = queryset.prefetch_related(get_user_annotations_prefetch(self.project, self.request.user))
         if not self.request.query_params.get('is_checked'):
             return queryset
 
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        # checked documents are the ones somebody annotated
         is_null = self.request.query_params.get('is_checked') == 'true'
-        queryset = project.get_documents(is_null).distinct()
+        completed = DocumentCompletion.objects.filter(project=self.kwargs['project_id']).values('document')
+        if is_null:
+            queryset = queryset.exclude(id__in=completed)
+        else:
+            queryset = queryset.filter(id__in=completed)
 
         return queryset
 
 
+class DocumentQueue(generics.GenericAPIView):
+    """Hands out the next documents nobody has annotated, leasing them to the
+    annotator for WORK_LEASE_SECONDS so that others get different ones."""
+    permission_classes = (IsAuthenticated, IsProjectUser)
+    default_limit = 10
+    max_limit = 100
+
+    def post(self, request, *args, **kwargs):
+        project = get_project(self.request, self.kwargs['project_id'])
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        expires_at, document_ids = WorkItem.lease(project, request.user, max(limit, 1))
+        documents = Document.objects.filter(id__in=document_ids).order_by('id') \
+                                    .prefetch_related(get_user_annotations_prefetch(project, request.user))
+        serializer = project.get_document_serializer()(documents, many=True, context={'request': request})
+
+        return Response({'expires_at': expires_at, 'results': serializer.data})
+
+
+class DocumentWindow(DocumentList):
+    """A window of documents to annotate, with the user's annotations, the
+    project's labels and the user's progress, so that the annotation page
+    needs one request per window. Unchanged windows are answered with 304."""
+    http_method_names = ['get', 'head', 'options']
+    pagination_class = DocumentWindowPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        # annotations are fetched only for windows that changed
+        return super(DocumentWindow, self).get_queryset().prefetch_related(None)
+
+    def list(self, request, *args, **kwargs):
+        documents = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        progress = self.project.get_progress(request.user)
+        etag = get_window_etag(request.user, self.project, documents, progress)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            prefetch_related_objects(documents, get_user_annotations_prefetch(self.project, request.user))
+            response = self.get_paginated_response(self.get_serializer(documents, many=True).data)
+            response.data['labels'] = LabelSerializer(self.project.labels.order_by('id'), many=True).data
+            response.data['progress'] = progress
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+
+def get_user_annotations_prefetch(project, user):
+    # one query for the annotations of all documents instead of one per document
+    annotation_class = project.get_annotation_class()
+    related_name = annotation_class._meta.get_field('document').remote_field.related_name
+    annotations = annotation_class.objects.filter(user=user).order_by('id')
+
+    return Prefetch(related_name, queryset=annotations, to_attr='user_annotations')
+
+
+def get_window_etag(user, project, documents, progress):
+    # annotation changes bump the updated_at of the documents they show on, label changes the project's
+    state = [user.id, project.updated_at.isoformat(), progress['total'], progress['remaining']]
+    state.extend('{}:{}'.format(document.id, document.updated_at.isoformat()) for document in documents)
+
+    return '"{}"'.format(hashlib.md5(' '.join(map(str, state)).encode('utf-8')).hexdigest())
+
+
 class AnnotationList(generics.ListCreateAPIView):
+    """The user's annotations of a document.
+
+    Besides single creates, PATCH creates and deletes many annotations, and
+    PUT replaces all of them, writing only the difference. Responses carry
+    an ETag which PUT checks against If-Match, so that concurrent edits of
+    the same annotations are not overwritten.
+    """
     pagination_class = None
     permission_classes = (IsAuthenticated, IsProjectUser)
 
+    @cached_property
+    def project(self):
+        return get_project(self.request, self.kwargs['project_id'])
+
     def get_serializer_class(self):
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
-        self.serializer_class = project.get_annotation_serializer()
+        self.serializer_class = self.project.get_annotation_serializer()
 
         return self.serializer_class
 
     def get_queryset(self):
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
-        document = project.documents.get(id=self.kwargs['doc_id'])
+        document = self.project.documents.get(id=self.kwargs['doc_id'])
         self.queryset = document.get_annotations()
         self.queryset = self.queryset.filter(user=self.request.user)
 
         return self.queryset
 
+    def list(self, request, *args, **kwargs):
+        return self.get_annotations_response(list(self.get_queryset()))
+
     def perform_create(self, serializer):
         doc = get_object_or_404(Document, pk=self.kwargs['doc_id'])
-        serializer.save(document=doc, user=self.request.user)
+        # posting a machine suggestion of the user again confirms it
+        annotation_class = self.project.get_annotation_class()
+        key = get_annotation_key(annotation_class(**serializer.validated_data))
+        serializer.instance = next((annotation for annotation in self.get_queryset().filter(manual=False)
+                                    if get_annotation_key(annotation) == key), None)
+        serializer.save(document=doc, user=self.request.user, manual=True)
+
+    def patch(self, request, *args, **kwargs):
+        """Creates and deletes many of the user's annotations of the document at once,
+        and returns all of them."""
+        document = get_object_or_404(self.project.documents, pk=self.kwargs['doc_id'])
+        serializer = AnnotationBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = self.validate_annotations(serializer.validated_data['create'])
+        try:
+            self.perform_bulk_update(document, created, serializer.validated_data['delete'])
+        except IntegrityError:
+            raise ValidationError({'create': ['Annotations must be unique.']})
+
+        return self.get_annotations_response(list(self.get_queryset()))
+
+    def put(self, request, *args, **kwargs):
+        """Replaces the user's annotations of the document with the given ones.
+        Annotations already stored are kept, so only the difference is written,
+        and kept machine suggestions become manual annotations."""
+        annotation_class = self.project.get_annotation_class()
+        desired = {get_annotation_key(annotation_class(**data)): data
+                   for data in self.validate_annotations(request.data)}
+        with transaction.atomic():
+            # concurrent replacements of the document's annotations wait for each other
+            document = get_object_or_404(self.project.documents.select_for_update(), pk=self.kwargs['doc_id'])
+            current = list(annotation_class.objects.filter(document=document, user=request.user).order_by('id'))
+            if_match = request.META.get('HTTP_IF_MATCH')
+            if if_match and get_annotations_etag(current) not in parse_etags(if_match):
+                return Response({'detail': 'The annotations were changed by another request.'},
+                                status=status.HTTP_412_PRECONDITION_FAILED)
+            stored = {get_annotation_key(annotation) for annotation in current}
+            created = [data for key, data in desired.items() if key not in stored]
+            deleted = [annotation for annotation in current if get_annotation_key(annotation) not in desired]
+            confirmed = [annotation for annotation in current
+                         if get_annotation_key(annotation) in desired and not annotation.manual]
+            if created or deleted or confirmed:
+                self.perform_bulk_update(document, created, [annotation.id for annotation in deleted],
+                                         [annotation.id for annotation in confirmed])
+
+        return self.get_annotations_response(list(self.get_queryset()))
+
+    def validate_annotations(self, data):
+        # the project's labels are read once instead of once per annotation
+        labels = {label.id: label for label in self.project.labels.all()}
+        context = dict(self.get_serializer_context(), labels=labels)
+        serializer = self.get_serializer_class()(data=data, many=True, context=context)
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+
+        return serializer.validated_data
+
+    @transaction.atomic
+    def perform_bulk_update(self, document, created, deleted_ids, confirmed_ids=()):
+        """Creates annotations from validated data, and deletes and confirms the
+        user's annotations of the document with the given ids."""
+        annotation_class = self.project.get_annotation_class()
+        # The rows are locked, so that concurrent requests deleting or confirming
+        # the same annotations count each of them once.
+        deleted_ids, confirmed_ids = set(deleted_ids), set(confirmed_ids) - set(deleted_ids)
+        annotations = annotation_class.objects.filter(document=document, user=self.request.user)
+        locked = list(annotations.select_for_update().filter(id__in=deleted_ids | confirmed_ids))
+        deleted = [annotation for annotation in locked if annotation.id in deleted_ids]
+        confirmed = [annotation for annotation in locked if annotation.id in confirmed_ids and not annotation.manual]
+        # Nothing refers to annotations and they have no delete receivers,
+        # so Django deletes them in one query without loading them.
+        annotations.filter(id__in=[annotation.id for annotation in deleted]).delete()
+        created = annotation_class.objects.bulk_create(annotation_class(document=document, user=self.request.user,
+                                                                        **data) for data in created)
+        annotations.filter(id__in=[annotation.id for annotation in confirmed]) \
+                   .update(manual=True, updated_at=timezone.now())
+
+        # Bulk inserts and deletes send no signals.
+        counts, completions = Counter(), Counter()
+        for annotation in created:
+            counts[annotation.get_counter_key()] += 1
+            completions[annotation.get_completion_key()] += 1
+        for annotation in deleted:
+            counts[annotation.get_counter_key()] -= 1
+            completions[annotation.get_completion_key()] -= 1
+        for annotation in confirmed:
+            annotation.manual = True
+            completions[annotation.get_completion_key()] += 1
+        AnnotationCounter.add(self.project.id, counts)
+        DocumentCompletion.add(self.project.id, completions)
+        Document.objects.filter(pk=document.id).update(updated_at=timezone.now())
+        ExportSnapshot.mark_stale(self.project.id)
+
+    def get_annotations_response(self, annotations):
+        response = Response(self.get_serializer(annotations, many=True).data)
+        response['ETag'] = get_annotations_etag(annotations)
+
+        return response
+
+
+def get_annotation_key(annotation):
+    # annotations are identified by their unique fields besides document and user
+    fields = [field for field in annotation._meta.unique_together[0] if field not in ('document', 'user')]
+
+    return tuple(annotation.serializable_value(field) for field in fields)
+
+
+def get_annotations_etag(annotations):
+    state = sorted((annotation.id,) + get_annotation_key(annotation) for annotation in annotations)
+
+    return '"{}"'.format(hashlib.md5(repr(state).encode('utf-8')).hexdigest())
 
 
 class AnnotationDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsAuthenticated, IsProjectUser, IsOwnAnnotation)
 
     def get_serializer_class(self):
-        project = get_object_or_404(Project, pk=self.kwargs['project_id'])
+        project = get_project(self.request, self.kwargs['project_id'])
         self.serializer_class = project.get_annotation_serializer()
 
         return self.serializer_class
@@ -155,3 +396,88 @@ class AnnotationDetail(generics.RetrieveUpdateDestroyAPIView):
         self.check_object_permissions(self.request, obj)
 
         return obj
+
+    def perform_update(self, serializer):
+        # an edited machine suggestion is the annotator's own
+        serializer.save(manual=True)
+
+
+class ImportJobDetail(generics.RetrieveAPIView):
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+    permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUser)
+
+    def get_queryset(self):
+        queryset = self.queryset.filter(project=self.kwargs['project_id'])
+
+        return queryset
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        obj = get_object_or_404(queryset, pk=self.kwargs['job_id'])
+        self.check_object_permissions(self.request, obj)
+
+        return obj
+
+
+class ChunkedUploadList(generics.CreateAPIView):
+    queryset = ChunkedUpload.objects.all()
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUser)
+
+    def perform_create(self, serializer):
+        project = get_project(self.request, self.kwargs['project_id'])
+        serializer.save(project=project, user=self.request.user)
+
+
+class ChunkedUploadDetail(generics.RetrieveAPIView):
+    queryset = ChunkedUpload.objects.all()
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUser)
+
+    def get_queryset(self):
+        queryset = self.queryset.filter(project=self.kwargs['project_id'])
+
+        return queryset
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        obj = get_object_or_404(queryset, pk=self.kwargs['upload_id'])
+        self.check_object_permissions(self.request, obj)
+
+        return obj
+
+
+class ChunkedUploadChunk(APIView):
+    permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUser)
+
+    def put(self, request, *args, **kwargs):
+        upload = get_object_or_404(ChunkedUpload, project=self.kwargs['project_id'], pk=self.kwargs['upload_id'],
+                                   job__isnull=True)
+        checksum = request.META.get('HTTP_X_CHUNK_SHA256', '')
+        try:
+            digest = save_chunk(upload, self.kwargs['index'], request.stream or BytesIO(), checksum)
+        except ImportFileError as e:
+            return Response({'detail': e.message}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'index': self.kwargs['index'], 'checksum': digest})
+
+
+class ChunkedUploadFinalize(APIView):
+    permission_classes = (IsAuthenticated, IsProjectUser, IsAdminUser)
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        queryset = ChunkedUpload.objects.select_for_update().filter(project=self.kwargs['project_id'])
+        upload = get_object_or_404(queryset, pk=self.kwargs['upload_id'])
+        if upload.job is None:
+            try:
+                file_path = assemble_chunks(upload)
+            except ImportFileError as e:
+                return Response({'detail': e.message}, status=status.HTTP_400_BAD_REQUEST)
+            upload.job = ImportJob.objects.create(project=upload.project, user=upload.user, file_path=file_path,
+                                                  file_format=upload.file_format, duplicates=upload.duplicates)
+            upload.save()
+
+        url = reverse('import-job', args=[upload.project_id, upload.job_id])
+        return Response({'id': upload.job_id, 'url': url}, status=status.HTTP_202_ACCEPTED)
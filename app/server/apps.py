@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ServerConfig(AppConfig):
     name = 'server'
+
+    def ready(self):
+        from . import signals  # noqa: F401
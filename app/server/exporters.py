@@ -0,0 +1,395 @@
+import csv
+import json
+import logging
+import os
+import struct
+import tempfile
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+import openpyxl
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from .models import Document, ExportSnapshot, Project
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 64 * 1024
+# Each document of a snapshot is indexed by its id, offset and length.
+INDEX_RECORD = struct.Struct('<qqq')
+
+
+def iter_documents(project, docs, chunk_size=None):
+    """Yields ``(document, annotations)`` pairs of docs in id order.
+
+    Documents are read with a server-side iterator, and the annotations of
+    each chunk of documents are fetched in one query together with their
+    labels and users, so an export runs one query per chunk.
+    """
+    chunk_size = chunk_size or settings.EXPORT_BATCH_SIZE
+    annotation_class = project.get_annotation_class()
+    related = ('user',) if project.is_type_of(Project.Seq2seq) else ('user', 'label')
+
+    for chunk in chunked(docs.order_by('id').iterator(chunk_size=chunk_size), chunk_size):
+        annotations = defaultdict(list)
+        queryset = annotation_class.objects.filter(document_id__in=[document.id for document in chunk]) \
+                                           .select_related(*related).order_by('id')
+        for annotation in queryset:
+            annotations[annotation.document_id].append(annotation)
+        for document in chunk:
+            document.project = project
+            yield document, annotations[document.id]
+
+
+def iter_json_lines(project, docs):
+    for document, annotations in iter_documents(project, docs):
+        yield json.dumps(document.to_json(annotations), ensure_ascii=False) + '\n'
+
+
+def get_table_header(project):
+    if project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
+        return ['id', 'text', 'label', 'user', 'metadata']
+    elif project.is_type_of(Project.SEQUENCE_LABELING):
+        return ['text', 'labels', 'metadata']
+    elif project.is_type_of(Project.Seq2seq):
+        return ['id', 'text', 'sentence', 'user', 'metadata']
+    else:
+        raise ValueError('Invalid project_type')
+
+
+def iter_table_rows(project, docs):
+    """Yields the header and then the CSV/Excel rows of docs.
+
+    Sequence labeling has one row per document, the other project types one
+    row per annotation.
+    """
+    yield get_table_header(project)
+    for document, annotations in iter_documents(project, docs):
+        yield from get_table_rows(project, document, annotations)
+
+
+def get_table_rows(project, document, annotations):
+    dataset = document.to_csv(annotations)
+    if project.is_type_of(Project.SEQUENCE_LABELING):
+        return [[dataset[0], str(dataset[1]), dataset[2]]]
+    return dataset
+
+
+class Echo(object):
+    """A file-like object that returns what is written to it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv_lines(project, docs):
+    writer = csv.writer(Echo())
+    for row in iter_table_rows(project, docs):
+        yield writer.writerow(row)
+
+
+def write_excel(project, docs):
+    """Writes docs to a temporary xlsx file and returns the file, positioned at its start.
+
+    The workbook is written in write-only mode, which spools rows to disk
+    instead of keeping them in memory.
+    """
+    file = tempfile.NamedTemporaryFile(suffix='.xlsx')
+    save_excel(project, docs, file)
+    file.seek(0)
+
+    return file
+
+
+def save_excel(project, docs, file):
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    for row in iter_table_rows(project, docs):
+        worksheet.append([ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+                          for value in row])
+    workbook.save(file)
+
+
+def get_parquet_schema(project):
+    import pyarrow as pa
+
+    if project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
+        annotation = pa.struct([('user', pa.string()), ('label', pa.string())])
+    elif project.is_type_of(Project.SEQUENCE_LABELING):
+        annotation = pa.struct([('user', pa.string()), ('label', pa.string()),
+                                ('start_offset', pa.int32()), ('end_offset', pa.int32())])
+    elif project.is_type_of(Project.Seq2seq):
+        annotation = pa.struct([('user', pa.string()), ('text', pa.string())])
+    else:
+        raise ValueError('Invalid project_type')
+
+    return pa.schema([
+        ('doc_id', pa.int64()),
+        ('text', pa.string()),
+        ('metadata', pa.string()),
+        ('annotations', pa.list_(annotation)),
+    ])
+
+
+def get_parquet_annotation(project, annotation):
+    if project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
+        return {'user': annotation.user.username, 'label': annotation.label.text}
+    elif project.is_type_of(Project.SEQUENCE_LABELING):
+        return {'user': annotation.user.username, 'label': annotation.label.text,
+                'start_offset': annotation.start_offset, 'end_offset': annotation.end_offset}
+    else:
+        return {'user': annotation.user.username, 'text': annotation.text}
+
+
+def save_parquet(project, docs, file):
+    """Writes docs to a Parquet file, one row group per chunk of documents.
+
+    Annotations are kept per annotator as a list of structs, so sequence
+    spans can be read without parsing them out of text.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = get_parquet_schema(project)
+    writer = pq.ParquetWriter(file, schema)
+    try:
+        for chunk in chunked(iter_documents(project, docs), settings.EXPORT_BATCH_SIZE):
+            columns = [
+                pa.array([document.id for document, _ in chunk], schema.field('doc_id').type),
+                pa.array([document.text for document, _ in chunk], schema.field('text').type),
+                pa.array([document.metadata for document, _ in chunk], schema.field('metadata').type),
+                pa.array([[get_parquet_annotation(project, annotation) for annotation in annotations]
+                          for _, annotations in chunk], schema.field('annotations').type),
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+    finally:
+        writer.close()
+
+
+def write_parquet(project, docs):
+    file = tempfile.NamedTemporaryFile(suffix='.parquet')
+    save_parquet(project, docs, file)
+    file.seek(0)
+
+    return file
+
+
+def get_export_documents(project, labeled_only=True):
+    if labeled_only:
+        return project.get_documents(is_null=False).distinct()
+    return project.get_documents(is_null=False, user=True).distinct()
+
+
+def iter_segments(project, docs, export_format):
+    """Yields ``(document_id, data)`` pairs, data being the encoded lines of
+    each document in a JSON lines or CSV export."""
+    writer = csv.writer(Echo())
+    for document, annotations in iter_documents(project, docs):
+        if export_format == ExportSnapshot.JSON:
+            data = json.dumps(document.to_json(annotations), ensure_ascii=False) + '\n'
+        else:
+            data = ''.join(writer.writerow(row) for row in get_table_rows(project, document, annotations))
+        yield document.id, data.encode('utf-8')
+
+
+def read_index(path):
+    """Yields the ``(document_id, offset, length)`` records of a snapshot index."""
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(INDEX_RECORD.size * 4096)
+            if not block:
+                break
+            yield from INDEX_RECORD.iter_unpack(block)
+
+
+def copy_range(source, target, offset, length):
+    source.seek(offset)
+    while length > 0:
+        block = source.read(min(COPY_BUFFER_SIZE, length))
+        if not block:
+            raise IOError('Snapshot file is truncated')
+        target.write(block)
+        length -= len(block)
+
+
+def write_snapshot(project, docs, export_format, file, index, previous=None, since=None):
+    """Writes a JSON lines or CSV export of docs to file and its index to index.
+
+    With a previous ``(file_path, index_path)`` snapshot, documents that
+    were not updated since the given time are copied over from it byte for
+    byte, and only the others are rendered again. Returns the number of
+    rendered documents.
+    """
+    chunk_size = settings.EXPORT_BATCH_SIZE
+    if export_format == ExportSnapshot.CSV:
+        file.write(csv.writer(Echo()).writerow(get_table_header(project)).encode('utf-8'))
+    offset = file.tell()
+    rendered = 0
+
+    records = read_index(previous[1]) if previous else iter(())
+    record = next(records, None)
+    source = open(previous[0], 'rb') if previous else None
+    # Adjacent reused documents are copied from the previous file in one go.
+    run_start = run_end = None
+
+    try:
+        rows = docs.order_by('id').values_list('id', 'updated_at').iterator(chunk_size=chunk_size)
+        for chunk in chunked(rows, chunk_size):
+            reused = {}
+            for document_id, updated_at in chunk:
+                while record and record[0] < document_id:
+                    record = next(records, None)
+                if record and record[0] == document_id and updated_at < since:
+                    reused[document_id] = record[1:]
+
+            fresh_ids = [document_id for document_id, _ in chunk if document_id not in reused]
+            fresh = {}
+            if fresh_ids:
+                fresh = dict(iter_segments(project, Document.objects.filter(id__in=fresh_ids), export_format))
+                rendered += len(fresh_ids)
+
+            for document_id, _ in chunk:
+                if document_id in reused:
+                    start, length = reused[document_id]
+                    if run_end != start:
+                        if run_start is not None:
+                            copy_range(source, file, run_start, run_end - run_start)
+                        run_start = start
+                    run_end = start + length
+                else:
+                    if run_start is not None:
+                        copy_range(source, file, run_start, run_end - run_start)
+                        run_start = run_end = None
+                    data = fresh.get(document_id, b'')
+                    length = len(data)
+                    file.write(data)
+                index.write(INDEX_RECORD.pack(document_id, offset, length))
+                offset += length
+
+        if run_start is not None:
+            copy_range(source, file, run_start, run_end - run_start)
+    finally:
+        if source:
+            source.close()
+
+    return rendered
+
+
+FULL_WRITERS = {
+    ExportSnapshot.EXCEL: save_excel,
+    ExportSnapshot.PARQUET: save_parquet,
+}
+FILE_EXTENSIONS = {
+    ExportSnapshot.EXCEL: 'xlsx',
+}
+
+
+def refresh_snapshot(snapshot):
+    """Brings a snapshot up to date with its project and returns it.
+
+    JSON and CSV snapshots are refreshed incrementally from the previous
+    file; Excel and Parquet files cannot be spliced and are written from
+    scratch.
+    """
+    project = snapshot.project
+    started_at = timezone.now()
+    # Changes made while the snapshot is being written mark it stale again.
+    ExportSnapshot.objects.filter(pk=snapshot.pk).update(is_stale=False, stale_since=None)
+
+    os.makedirs(settings.EXPORT_SNAPSHOT_DIR, exist_ok=True)
+    extension = FILE_EXTENSIONS.get(snapshot.export_format, snapshot.export_format)
+    file_path = os.path.join(settings.EXPORT_SNAPSHOT_DIR, '{}.{}'.format(uuid.uuid4().hex, extension))
+    index_path = ''
+    docs = get_export_documents(project, snapshot.labeled_only)
+
+    try:
+        if snapshot.export_format in FULL_WRITERS:
+            with open(file_path, 'wb') as f:
+                FULL_WRITERS[snapshot.export_format](project, docs, f)
+            rendered = docs.count()
+        else:
+            index_path = file_path + '.idx'
+            previous = None
+            if snapshot.refreshed_at and os.path.exists(snapshot.file_path) and os.path.exists(snapshot.index_path):
+                previous = (snapshot.file_path, snapshot.index_path)
+            with open(file_path, 'wb') as f, open(index_path, 'wb') as index:
+                rendered = write_snapshot(project, docs, snapshot.export_format, f, index,
+                                          previous=previous, since=snapshot.refreshed_at)
+    except Exception:
+        ExportSnapshot.objects.filter(pk=snapshot.pk).update(is_stale=True, stale_since=started_at)
+        remove_files(file_path, index_path)
+        raise
+
+    # Only replace the files the snapshot was read from; if a concurrent
+    # refresh got there first, ours are discarded.
+    replaced = ExportSnapshot.objects.filter(pk=snapshot.pk, file_path=snapshot.file_path) \
+                                     .update(file_path=file_path, index_path=index_path,
+                                             size=os.path.getsize(file_path), documents_rewritten=rendered,
+                                             refreshed_at=started_at)
+    if replaced:
+        remove_files(snapshot.file_path, snapshot.index_path)
+    else:
+        remove_files(file_path, index_path)
+    snapshot.refresh_from_db()
+
+    return snapshot
+
+
+def remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def get_snapshot(project, export_format, labeled_only=True):
+    """Returns an up to date snapshot of a project, refreshing it if needed."""
+    snapshot, _ = ExportSnapshot.objects.get_or_create(project=project, export_format=export_format,
+                                                       labeled_only=labeled_only)
+    snapshot.project = project
+    if snapshot.is_stale or not os.path.exists(snapshot.file_path):
+        snapshot = refresh_snapshot(snapshot)
+
+    return snapshot
+
+
+def open_snapshot(project, export_format, labeled_only=True, attempts=3):
+    """Returns an up to date snapshot of a project and its file, opened for reading.
+
+    A concurrent refresh may remove the file between reading the snapshot
+    and opening it, in which case the new snapshot is read. Once the file
+    is open, removing it no longer affects the reader.
+    """
+    for attempt in range(attempts):
+        snapshot = get_snapshot(project, export_format, labeled_only)
+        try:
+            return snapshot, open(snapshot.file_path, 'rb')
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+
+
+def refresh_stale_snapshots(delay=None):
+    """Refreshes the snapshots that have been stale for at least delay seconds
+    (EXPORT_REFRESH_DELAY_SECONDS by default), so that snapshots of projects
+    being annotated are rewritten once per delay rather than after every change.
+
+    A snapshot that fails to refresh is logged and left stale for the next
+    round, so that it does not hold up the others.
+    """
+    delay = settings.EXPORT_REFRESH_DELAY_SECONDS if delay is None else delay
+    stale_before = timezone.now() - timedelta(seconds=delay)
+    snapshots = ExportSnapshot.objects.filter(Q(stale_since__isnull=True) | Q(stale_since__lte=stale_before),
+                                              is_stale=True)
+    refreshed = []
+    for snapshot in snapshots.select_related('project'):
+        try:
+            refreshed.append(refresh_snapshot(snapshot))
+        except Exception as e:
+            logger.exception(e)
+
+    return refreshed
@@ -0,0 +1,612 @@
+import ast
+import csv
+import hashlib
+import itertools as it
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, time as datetime_time, timedelta
+from io import TextIOWrapper
+
+import openpyxl
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, F, Max, Q, TextField, Value, When
+from django.utils import timezone
+
+from .models import Project, Document, DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation, ImportJob, \
+    ChunkedUpload, ExportSnapshot, AnnotationCounter, DocumentCompletion, WorkItem
+from .utils import chunked, get_content_hash
+
+
+logger = logging.getLogger(__name__)
+
+# Only the first errors of an import are kept on its job.
+MAX_REPORTED_ERRORS = 100
+
+# Buffer size used when copying uploaded chunks.
+COPY_BUFFER_SIZE = 64 * 1024
+
+# Number of hashes per query when looking for duplicates, and of documents
+# per query when updating their metadata (each takes three parameters).
+DUPLICATE_LOOKUP_SIZE = 500
+DUPLICATE_UPDATE_SIZE = 300
+
+# JSONL uploads are split into chunks of about this size for parallel parsing.
+PARSE_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Span lists as written by Python's repr(), e.g. "[[0, 5, 'PERSON']]".
+SPAN_PATTERN = r"""\[\s*(\d+)\s*,\s*(\d+)\s*,\s*(?:'([^'\\]*)'|"([^"\\]*)")\s*\]"""
+SPAN_LIST_RE = re.compile(r'\[\s*(?:{0}(?:\s*,\s*{0})*)?\s*\]'.format(SPAN_PATTERN))
+SPAN_RE = re.compile(SPAN_PATTERN)
+
+
+class ImportFileError(Exception):
+    def __init__(self, message):
+        super(ImportFileError, self).__init__(message)
+        self.message = message
+
+
+def txt_to_dict(txt):
+    text = str()
+    for line in txt:
+        line = line.decode('utf-8')
+        text += line
+    dictt = dict()
+    dictt['text'] = text
+    return dictt
+
+
+def cell_to_value(value):
+    # dates and times of spreadsheet cells are kept as ISO 8601 strings
+    if isinstance(value, (date, datetime_time)):
+        return value.isoformat()
+    return value
+
+
+def rows_to_dicts(rows, text_key='text', labels_key='labels'):
+    """Turns table rows into entries, one row at a time.
+
+    The first row is a header with a ``text`` column, or the first row of
+    a one-column table. Columns other than ``text`` and ``labels`` are kept
+    as metadata.
+    """
+    rows = iter(rows)
+    maybe_header = next(rows, None)
+    if not maybe_header:
+        return
+    maybe_header = ['' if title is None else str(title) for title in maybe_header]
+    if text_key in maybe_header:
+        header = maybe_header
+    elif len(maybe_header) == 1:
+        header = [text_key]
+        rows = it.chain([maybe_header], rows)
+    else:
+        raise ImportFileError('CSV file must have either a title with "text" column or have only one column ')
+
+    for row in rows:
+        entry = {title: cell_to_value(value) for title, value in zip(header, row) if value is not None and title}
+        if text_key not in entry:
+            continue
+        entry[text_key] = str(entry[text_key])
+        if entry.get(labels_key) == '':
+            del entry[labels_key]
+        yield entry
+
+
+def csv_to_dicts(file):
+    # csv.reader pulls buffered chunks from the file, so only the current
+    # row is held in memory.
+    # files saved by Excel start with a byte order mark
+    reader = csv.reader(TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    return rows_to_dicts(reader)
+
+
+def xlsx_to_dicts(file):
+    workbook = openpyxl.load_workbook(file, read_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        yield from rows_to_dicts(worksheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+SUPPORTED_FORMATS = ('txt', 'json', 'jsonl', 'csv', 'xlsx')
+
+
+def parse_entries(file, file_format):
+    if file_format == 'txt':
+        return [txt_to_dict(file)]
+    elif file_format in ('json', 'jsonl'):
+        return (json.loads(line) for line in file if line.strip())
+    elif file_format == 'csv':
+        return csv_to_dicts(file)
+    elif file_format == 'xlsx':
+        return xlsx_to_dicts(file)
+    else:
+        raise ImportFileError('Unsupported file format: {}'.format(file_format))
+
+
+class LabelDecoder(object):
+    """Decodes and validates the labels of a batch of entries.
+
+    Labels arrive either as lists (JSONL) or as their string form (CSV and
+    XLSX cells), e.g. ``[[0, 5, 'PERSON']]``. Strings are parsed with
+    ``json`` or ``ast.literal_eval``, never ``eval``. Each label is checked
+    against the project's labels and, for spans, the document text.
+    """
+
+    def __init__(self, project_type, label_dict):
+        self.project_type = project_type
+        self.label_dict = label_dict
+
+    def decode_batch(self, texts, raw_labels):
+        """Returns the decoded labels of each row and a list of ``(index, message)`` errors.
+
+        Decoded labels are label ids for classification, ``(start, end, label_id)``
+        tuples for sequence labeling and strings for seq2seq.
+        """
+        errors = []
+        decoded = []
+        for index, (text, labels) in enumerate(zip(texts, raw_labels)):
+            valid = []
+            try:
+                labels = self.parse(labels)
+            except ValueError as e:
+                errors.append((index, 'could not parse labels ({})'.format(e)))
+                labels = []
+            for label in labels:
+                try:
+                    valid.append(self.validate(text, label))
+                except (ValueError, TypeError, SyntaxError) as e:
+                    errors.append((index, str(e)))
+            decoded.append(valid)
+
+        return decoded, errors
+
+    def parse(self, labels):
+        if not labels:
+            return []
+        if isinstance(labels, str):
+            if SPAN_LIST_RE.fullmatch(labels):
+                return [[int(start), int(end), single or double]
+                        for start, end, single, double in SPAN_RE.findall(labels)]
+            try:
+                labels = json.loads(labels)
+            except ValueError:
+                try:
+                    labels = ast.literal_eval(labels)
+                except (ValueError, SyntaxError, MemoryError, RecursionError):
+                    raise ValueError('malformed value')
+        if not isinstance(labels, (list, tuple)):
+            raise ValueError('expected a list')
+        return labels
+
+    def validate(self, text, label):
+        if self.project_type == Project.SEQUENCE_LABELING:
+            if isinstance(label, str):
+                label = ast.literal_eval(label)
+            start, end, name = label
+            if not isinstance(start, int) or not isinstance(end, int):
+                raise ValueError('offsets must be integers in {!r}'.format(label))
+            if not 0 <= start < end <= len(text):
+                raise ValueError('span {!r} is out of the text range'.format(label))
+            return start, end, self.get_label_id(name)
+        elif self.project_type == Project.DOCUMENT_CLASSIFICATION:
+            return self.get_label_id(label)
+        elif self.project_type == Project.Seq2seq:
+            if not isinstance(label, str):
+                raise ValueError('expected a sentence, got {!r}'.format(label))
+            return label
+        else:
+            raise ValueError('Invalid project_type')
+
+    def get_label_id(self, name):
+        try:
+            return self.label_dict[name]
+        except (KeyError, TypeError):
+            raise ValueError('unknown label {!r}'.format(name))
+
+
+def prepare_batch(entries, decoder):
+    """Turns entries into ``(text, metadata, labels)`` rows ready to insert.
+
+    Entries that are not objects with a text are reported and become
+    ``None`` rows, so that every row keeps the position of its entry.
+    """
+    rows, errors = [], []
+    positions, texts, metadata, raw_labels = [], [], [], []
+    for index, entry in enumerate(entries):
+        rows.append(None)
+        if not isinstance(entry, dict):
+            errors.append((index, 'expected an object, got {}'.format(type(entry).__name__)))
+            continue
+        if entry.get('text') is None:
+            errors.append((index, 'missing text'))
+            continue
+        entry = entry.copy()
+        positions.append(index)
+        # JSON texts may be numbers, as table cells are
+        texts.append(str(entry.pop('text')))
+        metadata.append(json.dumps(entry, default=str))
+        raw_labels.append(entry.get('labels'))
+    labels, label_errors = decoder.decode_batch(texts, raw_labels)
+    for index, row in zip(positions, zip(texts, metadata, labels)):
+        rows[index] = row
+    errors.extend((positions[index], message) for index, message in label_errors)
+    errors.sort(key=lambda error: error[0])
+
+    return rows, errors
+
+
+class DocumentImporter(object):
+    """Inserts parsed entries into a project, one transaction per batch.
+
+    An entry is a dict with a ``text`` key and an optional ``labels`` key.
+    Every other key is kept as the document's metadata.
+    """
+
+    def __init__(self, project, user, batch_size=None, duplicates=ImportJob.ALLOW_DUPLICATES):
+        self.project = project
+        self.user = user
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.duplicates = duplicates
+        self.decoder = LabelDecoder(project.project_type, dict(project.labels.values_list('text', 'id')))
+        self.rows_seen = 0
+        self.rows_duplicated = 0
+        # only the first MAX_REPORTED_ERRORS errors are kept, but all are counted
+        self.errors = []
+        self.error_count = 0
+
+    def import_entries(self, entries):
+        count = 0
+        for batch in chunked(entries, self.batch_size):
+            count += self.insert_batch(batch)
+
+        return count
+
+    def insert_batch(self, batch):
+        return self.insert_rows(*prepare_batch(batch, self.decoder))
+
+    @transaction.atomic
+    def insert_rows(self, rows, errors=()):
+        self.error_count += len(errors)
+        self.errors.extend('Row {}: {}'.format(self.rows_seen + index + 1, message)
+                           for index, message in errors[:max(MAX_REPORTED_ERRORS - len(self.errors), 0)])
+        self.rows_seen += len(rows)
+        rows = [row for row in rows if row is not None]
+        hashes = [get_content_hash(text) for text, _, _ in rows]
+        if self.duplicates != ImportJob.ALLOW_DUPLICATES:
+            rows, hashes = self.remove_duplicates(rows, hashes)
+        documents = [Document(text=text, metadata=metadata, project=self.project, content_hash=content_hash)
+                     for (text, metadata, _), content_hash in zip(rows, hashes)]
+        document_ids = self.create_documents(documents)
+
+        annotations = []
+        for document_id, (_, _, labels) in zip(document_ids, rows):
+            annotations.extend(self.make_annotations(document_id, labels))
+        self.project.get_annotation_class().objects.bulk_create(annotations)
+        # Bulk inserts and updates send no signals.
+        AnnotationCounter.add(self.project.id, Counter(annotation.get_counter_key() for annotation in annotations))
+        # the documents are new, so none of them has a completion yet
+        completions = Counter(annotation.get_completion_key() for annotation in annotations)
+        DocumentCompletion.objects.bulk_create(
+            DocumentCompletion(project=self.project, document_id=document_id, user_id=user_id, annotations=count)
+            for (document_id, user_id), count in completions.items())
+        completed = {document_id for document_id, _ in completions}
+        WorkItem.objects.bulk_create(WorkItem(project=self.project, document_id=document_id)
+                                     for document_id in document_ids if document_id not in completed)
+        ExportSnapshot.mark_stale(self.project.id)
+
+        return len(documents)
+
+    def remove_duplicates(self, rows, hashes):
+        """Drops rows whose text is already in the project, updating their metadata if asked to."""
+        existing = defaultdict(list)
+        for hash_chunk in chunked(set(hashes), DUPLICATE_LOOKUP_SIZE):
+            queryset = Document.objects.filter(project=self.project, content_hash__in=hash_chunk)
+            for document_id, content_hash in queryset.values_list('id', 'content_hash'):
+                existing[content_hash].append(document_id)
+
+        unique_rows, unique_hashes, updates = [], [], []
+        # position of each new text in unique_rows
+        seen = {}
+        for row, content_hash in zip(rows, hashes):
+            if content_hash in existing:
+                updates.extend((document_id, row[1]) for document_id in existing[content_hash])
+            elif content_hash not in seen:
+                seen[content_hash] = len(unique_rows)
+                unique_rows.append(row)
+                unique_hashes.append(content_hash)
+                continue
+            elif self.duplicates == ImportJob.UPDATE_DUPLICATES:
+                # the last metadata of a text repeated within the batch wins, as it would across batches
+                text, _, labels = unique_rows[seen[content_hash]]
+                unique_rows[seen[content_hash]] = text, row[1], labels
+            self.rows_duplicated += 1
+
+        if self.duplicates == ImportJob.UPDATE_DUPLICATES:
+            update_documents('metadata', dict(updates).items(), updated_at=timezone.now())
+
+        return unique_rows, unique_hashes
+
+    def create_documents(self, documents):
+        if connection.features.can_return_ids_from_bulk_insert:
+            return [document.id for document in Document.objects.bulk_create(documents)]
+
+        # Backends without RETURNING (e.g. SQLite) leave the pks unset, so read
+        # back the rows added past the last id. The batch transaction keeps
+        # them contiguous, and the pk index keeps the lookup to this batch.
+        last_id = Document.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        Document.objects.bulk_create(documents)
+        document_ids = list(Document.objects.filter(project=self.project, id__gt=last_id)
+                                            .order_by('id')
+                                            .values_list('id', flat=True))
+        if len(document_ids) != len(documents):
+            raise RuntimeError('Concurrent insert detected while importing documents')
+
+        return document_ids
+
+    def make_annotations(self, document_id, labels):
+        if self.project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
+            return [DocumentAnnotation(document_id=document_id, label_id=label_id, user=self.user)
+                    for label_id in set(labels)]
+        elif self.project.is_type_of(Project.SEQUENCE_LABELING):
+            return [SequenceAnnotation(document_id=document_id, label_id=label_id, user=self.user,
+                                       start_offset=start, end_offset=end)
+                    for start, end, label_id in set(labels)]
+        elif self.project.is_type_of(Project.Seq2seq):
+            return [Seq2seqAnnotation(document_id=document_id, text=text, user=self.user)
+                    for text in set(labels)]
+        else:
+            raise ValueError('Invalid project_type')
+
+
+def update_documents(field, updates, **values):
+    """Sets a field of documents from ``(document_id, value)`` pairs, and the
+    given values of all of them, with one query per DUPLICATE_UPDATE_SIZE documents."""
+    for update_chunk in chunked(updates, DUPLICATE_UPDATE_SIZE):
+        cases = [When(id=document_id, then=Value(value)) for document_id, value in update_chunk]
+        Document.objects.filter(id__in=[document_id for document_id, _ in update_chunk]) \
+                        .update(**dict(values, **{field: Case(*cases, output_field=TextField())}))
+
+
+def stage_upload(uploaded_file, file_format):
+    """Writes an uploaded file to the staging directory and returns its path."""
+    os.makedirs(settings.IMPORT_STAGING_DIR, exist_ok=True)
+    file_path = os.path.join(settings.IMPORT_STAGING_DIR, '{}.{}'.format(uuid.uuid4().hex, file_format))
+    with open(file_path, 'wb') as f:
+        for chunk in uploaded_file.chunks():
+            f.write(chunk)
+
+    return file_path
+
+
+def get_chunk_dir(upload):
+    return os.path.join(settings.IMPORT_STAGING_DIR, 'chunks', upload.key.hex)
+
+
+def get_received_chunks(upload):
+    chunk_dir = get_chunk_dir(upload)
+    if not os.path.isdir(chunk_dir):
+        return []
+
+    return sorted(int(name) for name in os.listdir(chunk_dir) if name.isdigit())
+
+
+def save_chunk(upload, index, stream, checksum=''):
+    """Stores one chunk of a chunked upload, verifying its size and sha256 checksum.
+
+    The chunk is written to a temporary file and renamed into place, so a
+    retried or concurrent upload of the same chunk never leaves a partial file.
+    """
+    if not 0 <= index < upload.total_chunks:
+        raise ImportFileError('Chunk index {} is out of range'.format(index))
+
+    chunk_dir = get_chunk_dir(upload)
+    os.makedirs(chunk_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(chunk_dir, '{}.{}.part'.format(index, uuid.uuid4().hex))
+    try:
+        with open(tmp_path, 'wb') as f:
+            for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+                size += len(block)
+                if size > upload.chunk_size:
+                    raise ImportFileError('Chunk {} is larger than the chunk size'.format(index))
+                digest.update(block)
+                f.write(block)
+        expected_size = upload.get_chunk_size(index)
+        if size != expected_size:
+            raise ImportFileError('Chunk {} has {} bytes, expected {}'.format(index, size, expected_size))
+        if checksum and checksum.lower() != digest.hexdigest():
+            raise ImportFileError('Checksum mismatch for chunk {}'.format(index))
+        os.replace(tmp_path, os.path.join(chunk_dir, str(index)))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return digest.hexdigest()
+
+
+def assemble_chunks(upload):
+    """Concatenates the chunks of an upload into a staged file and returns its path."""
+    missing = sorted(set(range(upload.total_chunks)) - set(get_received_chunks(upload)))
+    if missing:
+        raise ImportFileError('Missing chunks: {}'.format(', '.join(map(str, missing[:20]))))
+
+    chunk_dir = get_chunk_dir(upload)
+    file_path = os.path.join(settings.IMPORT_STAGING_DIR, '{}.{}'.format(uuid.uuid4().hex, upload.file_format))
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        for index in range(upload.total_chunks):
+            with open(os.path.join(chunk_dir, str(index)), 'rb') as chunk:
+                for block in iter(lambda: chunk.read(COPY_BUFFER_SIZE), b''):
+                    digest.update(block)
+                    f.write(block)
+    if upload.checksum and upload.checksum.lower() != digest.hexdigest():
+        os.remove(file_path)
+        raise ImportFileError('Checksum mismatch for the assembled file')
+    shutil.rmtree(chunk_dir)
+
+    return file_path
+
+
+def expire_chunked_uploads():
+    """Removes the chunked uploads that were never finalized and received no
+    chunk for IMPORT_UPLOAD_EXPIRY_SECONDS, and returns how many there were.
+
+    Stale chunk directories are removed even without an upload, e.g. when
+    a chunk arrived while its upload was being removed.
+    """
+    expiry = settings.IMPORT_UPLOAD_EXPIRY_SECONDS
+    chunks_dir = os.path.join(settings.IMPORT_STAGING_DIR, 'chunks')
+    names = os.listdir(chunks_dir) if os.path.isdir(chunks_dir) else []
+    fresh = []
+    for name in names:
+        chunk_dir = os.path.join(chunks_dir, name)
+        # receiving a chunk renames it into the directory, which updates its mtime
+        if time.time() - os.path.getmtime(chunk_dir) < expiry:
+            fresh.append(name)
+        else:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    created_before = timezone.now() - timedelta(seconds=expiry)
+    uploads = ChunkedUpload.objects.filter(job__isnull=True, created_at__lt=created_before) \
+                                   .exclude(key__in=fresh)
+
+    return uploads.delete()[0]
+
+
+def claim_import_job():
+    """Marks the oldest pending job as running and returns it, or None.
+
+    Running jobs that stopped reporting progress for IMPORT_STALE_SECONDS
+    were left by a crashed worker, and are claimed again to be resumed.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.IMPORT_STALE_SECONDS)
+    jobs = ImportJob.objects.filter(Q(status=ImportJob.PENDING) |
+                                    Q(status=ImportJob.RUNNING, heartbeat_at__lt=stale))
+    for job in jobs.order_by('id')[:10]:
+        # only one worker wins the job, even if others saw the same heartbeat
+        claimed = ImportJob.objects.filter(pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at) \
+                                   .update(status=ImportJob.RUNNING, started_at=job.started_at or now,
+                                           heartbeat_at=now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+    return None
+
+
+def split_file(file_path, chunk_bytes):
+    """Returns ``(start, end)`` byte ranges of about chunk_bytes that end on line boundaries."""
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def parse_jsonl_range(file_path, start, end, decoder):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines()
+    entries = [json.loads(line) for line in lines if line.strip()]
+
+    return prepare_batch(entries, decoder)
+
+
+def parse_jsonl_parallel(file_path, decoder, workers, chunk_bytes=PARSE_CHUNK_BYTES):
+    """Parses a JSONL file in a process pool and yields ``(rows, errors)`` per chunk, in file order."""
+    # Forked workers must not share the parent's database connections.
+    # They can't be closed inside a transaction, where nothing is forked anyway.
+    if not connection.in_atomic_block:
+        connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in split_file(file_path, chunk_bytes):
+            pending.append(executor.submit(parse_jsonl_range, file_path, start, end, decoder))
+            # Bound the number of parsed chunks waiting for the inserter.
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_prepared_batches(job, importer):
+    workers = settings.IMPORT_PARSE_WORKERS
+    if job.file_format in ('json', 'jsonl') and workers > 1 \
+            and os.path.getsize(job.file_path) >= settings.IMPORT_PARALLEL_MIN_BYTES:
+        batch_size = importer.batch_size
+        for rows, errors in parse_jsonl_parallel(job.file_path, importer.decoder, workers):
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size], [(index - i, message) for index, message in errors
+                                               if i <= index < i + batch_size]
+    else:
+        with open(job.file_path, 'rb') as f:
+            entries = parse_entries(f, job.file_format)
+            for batch in chunked(entries, importer.batch_size):
+                yield prepare_batch(batch, importer.decoder)
+
+
+def skip_rows(batches, count):
+    """Drops the first count rows of ``(rows, errors)`` batches."""
+    for rows, errors in batches:
+        if count >= len(rows):
+            count -= len(rows)
+            continue
+        if count:
+            rows = rows[count:]
+            errors = [(index - count, message) for index, message in errors if index >= count]
+            count = 0
+        yield rows, errors
+
+
+def run_import_job(job):
+    """Imports the file of a job. A job resumed after a crash skips the rows
+    it already inserted."""
+    importer = DocumentImporter(job.project, job.user, duplicates=job.duplicates)
+    importer.rows_seen = job.rows_parsed
+    importer.rows_duplicated = job.rows_duplicated
+    importer.errors = json.loads(job.errors)
+    importer.error_count = job.error_count
+    try:
+        for rows, errors in skip_rows(iter_prepared_batches(job, importer), job.rows_parsed):
+            # the progress is saved with the batch, so that a resumed job knows where to start
+            with transaction.atomic():
+                inserted = importer.insert_rows(rows, errors)
+                ImportJob.objects.filter(pk=job.pk).update(rows_parsed=F('rows_parsed') + len(rows),
+                                                           rows_inserted=F('rows_inserted') + inserted,
+                                                           rows_duplicated=importer.rows_duplicated,
+                                                           errors=json.dumps(importer.errors),
+                                                           error_count=importer.error_count,
+                                                           heartbeat_at=timezone.now())
+        job.refresh_from_db()
+        job.status = ImportJob.DONE
+    except Exception as e:
+        logger.exception(e)
+        job.refresh_from_db()
+        job.add_error(getattr(e, 'message', str(e)))
+        job.status = ImportJob.FAILED
+    finally:
+        job.finished_at = timezone.now()
+        job.save()
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+
+    return job
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from server.importers import update_documents
+from server.models import Document
+from server.utils import get_content_hash
+
+
+class Command(BaseCommand):
+    help = 'Computes the content hash of documents imported before it existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, default=None,
+                            help='Only backfill the documents of this project.')
+        parser.add_argument('--chunk_size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = Document.objects.filter(content_hash='')
+        if options['project']:
+            queryset = queryset.filter(project=options['project'])
+
+        count = 0
+        last_id = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id).order_by('id')
+                                 .values_list('id', 'text')[:options['chunk_size']])
+            if not chunk:
+                break
+            with transaction.atomic():
+                update_documents('content_hash', [(document_id, get_content_hash(text)) for document_id, text in chunk])
+            last_id = chunk[-1][0]
+            count += len(chunk)
+            self.stdout.write('{} documents hashed'.format(count))
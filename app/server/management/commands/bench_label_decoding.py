@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from server.importers import LabelDecoder
+from server.models import Project
+
+
+def legacy_decode(labels):
+    # The eval based decoding used by uploads before LabelDecoder.
+    if isinstance(labels, str):
+        labels = eval(labels)
+    label_list = list()
+    for label in labels:
+        try:
+            label_list.append(eval(label))
+        except Exception:
+            label_list.append(label)
+    return label_list
+
+
+class Command(BaseCommand):
+    help = 'Compares rows/sec of the legacy and current label decoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--spans', type=int, default=5)
+        parser.add_argument('--batch_size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        names = ['PERSON', 'LOC', 'ORG', 'DATE']
+        label_dict = {name: i for i, name in enumerate(names, start=1)}
+        text = 'x' * 200
+        rows = []
+        for _ in range(options['rows']):
+            spans = []
+            for _ in range(options['spans']):
+                start = random.randrange(0, 190)
+                spans.append([start, start + 10, random.choice(names)])
+            rows.append(repr(spans))
+
+        start = time.perf_counter()
+        for labels in rows:
+            [(s, e, label_dict[name]) for s, e, name in legacy_decode(labels)]
+        legacy = len(rows) / (time.perf_counter() - start)
+
+        decoder = LabelDecoder(Project.SEQUENCE_LABELING, label_dict)
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            decoder.decode_batch([text] * len(batch), batch)
+        current = len(rows) / (time.perf_counter() - start)
+
+        self.stdout.write('legacy eval:  {:,.0f} rows/sec'.format(legacy))
+        self.stdout.write('LabelDecoder: {:,.0f} rows/sec'.format(current))
@@ -0,0 +1,68 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from server.models import Document, DocumentAnnotation, DocumentCompletion, Label, Project
+from server.utils import chunked
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+class Command(BaseCommand):
+    help = 'Compares progress and is_checked lookups with and without the completion table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=1000000)
+        parser.add_argument('--annotated', type=float, default=0.5,
+                            help='Fraction of the documents annotated by the user.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch_size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        # everything is created in a transaction that is rolled back at the end
+        with transaction.atomic():
+            project = Project.objects.create(name='bench', description='', guideline='',
+                                             project_type=Project.DOCUMENT_CLASSIFICATION)
+            user = User.objects.create(username='bench-progress')
+            label = Label.objects.create(project=project, text='bench')
+            self.populate(project, user, label, options)
+
+            repeat = options['repeat']
+            completed = DocumentCompletion.objects.filter(project=project).values('document')
+            timings = [
+                ('progress (exclude)', lambda: project.get_documents(is_null=True, user=user).count()),
+                ('progress (completions)', lambda: project.get_progress(user)['remaining']),
+                ('is_checked count (join)', lambda: project.get_documents(is_null=True).distinct().count()),
+                ('is_checked count (completions)',
+                 lambda: project.documents.exclude(id__in=completed).count()),
+            ]
+            for name, func in timings:
+                elapsed, result = measure(func, repeat)
+                self.stdout.write('{:32} {:10.1f} ms  ({})'.format(name, elapsed, str(result)[:30]))
+
+            transaction.set_rollback(True)
+
+    def populate(self, project, user, label, options):
+        total, batch_size = options['documents'], options['batch_size']
+        every = max(1, round(1 / options['annotated'])) if options['annotated'] else 0
+        for chunk in chunked(range(total), batch_size):
+            docs = Document.objects.bulk_create(Document(project=project, text='document {}'.format(i))
+                                                for i in chunk)
+            if not docs[0].pk:
+                start = Document.objects.filter(project=project).order_by('-id').values_list('id', flat=True)[0]
+                for i, doc in enumerate(docs):
+                    doc.pk = start - len(docs) + 1 + i
+            annotated = [doc for i, doc in zip(chunk, docs) if every and i % every == 0]
+            DocumentAnnotation.objects.bulk_create(DocumentAnnotation(document=doc, user=user, label=label)
+                                                   for doc in annotated)
+            DocumentCompletion.objects.bulk_create(DocumentCompletion(project=project, document=doc, user=user,
+                                                                      annotations=1)
+                                                   for doc in annotated)
+        self.stdout.write('{:,} documents, {:.0%} annotated'.format(total, options['annotated']))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from server.importers import claim_import_job, expire_chunked_uploads, run_import_job
+
+
+class Command(BaseCommand):
+    help = 'Processes queued dataset imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll_seconds', type=float, default=2)
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no pending imports.')
+
+    def handle(self, *args, **options):
+        poll_seconds = options['poll_seconds']
+
+        while True:
+            job = claim_import_job()
+            if job is None:
+                expire_chunked_uploads()
+                if options['once']:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            job = run_import_job(job)
+            self.stdout.write(
+                'Import {id} {status}: {rows} rows inserted'.format(
+                    id=job.id,
+                    status=job.status,
+                    rows=job.rows_inserted))
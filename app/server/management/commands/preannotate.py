@@ -0,0 +1,44 @@
+import time
+
+from django.core.management import CommandError
+from django.core.management.base import BaseCommand
+
+from server.models import Project
+from server.preannotation import PreannotationError, preannotate
+
+
+class Command(BaseCommand):
+    help = 'Suggests labels for the unlabeled documents of a document classification project'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, required=True)
+        parser.add_argument('--user', required=True,
+                            help='Username of the project member who reviews the suggestions.')
+        parser.add_argument('--batch_size', type=int, default=None,
+                            help='Number of documents labeled per query.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Train only on the annotations written or confirmed since the last incremental run.')
+        parser.add_argument('--poll_seconds', type=float, default=None,
+                            help='Keep pre-annotating with this pause in between, instead of once.')
+
+    def handle(self, *args, **options):
+        project = Project.objects.filter(pk=options['project']).first()
+        if project is None:
+            raise CommandError('Project {} does not exist'.format(options['project']))
+        user = project.users.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError('{} is not a member of project {}'.format(options['user'], project.id))
+
+        while True:
+            try:
+                count = preannotate(project, user, options['batch_size'], options['incremental'])
+                self.stdout.write('{} documents pre-annotated'.format(count))
+            except PreannotationError as e:
+                if options['poll_seconds'] is None:
+                    raise CommandError(e.message)
+                # there may be enough annotations to train on next time
+                self.stderr.write(e.message)
+
+            if options['poll_seconds'] is None:
+                break
+            time.sleep(options['poll_seconds'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from server.models import AnnotationCounter, Project
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the annotation counters of projects from their annotations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, default=None,
+                            help='Only rebuild the counters of this project.')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.all()
+        if options['project']:
+            projects = projects.filter(pk=options['project'])
+
+        for project in projects:
+            AnnotationCounter.recount(project)
+            self.stdout.write('Project {} recounted'.format(project.id))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from server.exporters import refresh_stale_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Refreshes stale export snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll_seconds', type=float, default=60)
+        parser.add_argument('--delay_seconds', type=float, default=None,
+                            help='Only refresh snapshots stale for this long (EXPORT_REFRESH_DELAY_SECONDS).')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no snapshots to refresh.')
+
+    def handle(self, *args, **options):
+        poll_seconds = options['poll_seconds']
+
+        while True:
+            snapshots = refresh_stale_snapshots(options['delay_seconds'])
+            for snapshot in snapshots:
+                self.stdout.write(
+                    'Snapshot {id} refreshed: {documents} documents rewritten'.format(
+                        id=snapshot.id,
+                        documents=snapshot.documents_rewritten))
+            if not snapshots:
+                if options['once']:
+                    break
+                time.sleep(poll_seconds)
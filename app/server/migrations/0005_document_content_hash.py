@@ -0,0 +1,32 @@
+# Generated by Django 2.1.7 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0004_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicates',
+            field=models.CharField(choices=[('allow', 'import duplicates'), ('skip', 'skip duplicates'), ('update', 'update metadata of duplicates')], default='allow', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='rows_duplicated',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['project', 'content_hash'], name='server_docu_project_3b3147_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.1.7 on 2026-10-18 02:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0006_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('export_format', models.CharField(choices=[('json', 'JSON'), ('csv', 'CSV'), ('excel', 'Excel')], max_length=10)),
+                ('labeled_only', models.BooleanField(default=True)),
+                ('file_path', models.CharField(blank=True, default='', max_length=500)),
+                ('index_path', models.CharField(blank=True, default='', max_length=500)),
+                ('size', models.BigIntegerField(default=0)),
+                ('is_stale', models.BooleanField(db_index=True, default=True)),
+                ('documents_rewritten', models.IntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['project', 'updated_at'], name='server_docu_project_25b4e8_idx'),
+        ),
+        migrations.AddField(
+            model_name='exportsnapshot',
+            name='project',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_snapshots', to='server.Project'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportsnapshot',
+            unique_together={('project', 'export_format', 'labeled_only')},
+        ),
+    ]
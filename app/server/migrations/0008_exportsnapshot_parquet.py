@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0007_exportsnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportsnapshot',
+            name='export_format',
+            field=models.CharField(choices=[('json', 'JSON'), ('csv', 'CSV'), ('excel', 'Excel'), ('parquet', 'Parquet')], max_length=10),
+        ),
+    ]
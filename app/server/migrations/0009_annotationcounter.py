@@ -0,0 +1,53 @@
+# Generated by Django 2.1.7 on 2026-10-18 02:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+ANNOTATION_MODELS = {
+    'DocumentClassification': 'DocumentAnnotation',
+    'SequenceLabeling': 'SequenceAnnotation',
+    'Seq2seq': 'Seq2seqAnnotation',
+}
+
+
+def count_annotations(apps, schema_editor):
+    Project = apps.get_model('server', 'Project')
+    AnnotationCounter = apps.get_model('server', 'AnnotationCounter')
+    for project in Project.objects.all():
+        annotation_class = apps.get_model('server', ANNOTATION_MODELS[project.project_type])
+        annotations = annotation_class.objects.filter(document__project=project).order_by()
+        if project.project_type == 'Seq2seq':
+            rows = ((None, user_id, count) for user_id, count in
+                    annotations.values_list('user').annotate(models.Count('id')))
+        else:
+            rows = annotations.values_list('label', 'user').annotate(models.Count('id'))
+        AnnotationCounter.objects.bulk_create(
+            AnnotationCounter(project=project, label_id=label_id, user_id=user_id, count=count)
+            for label_id, user_id, count in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('server', '0008_exportsnapshot_parquet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('label', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='server.Label')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_counters', to='server.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='annotationcounter',
+            unique_together={('project', 'label', 'user')},
+        ),
+        migrations.RunPython(count_annotations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.7 on 2026-10-18 02:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from server.utils import chunked
+
+ANNOTATION_MODELS = ('DocumentAnnotation', 'SequenceAnnotation', 'Seq2seqAnnotation')
+
+
+def complete_documents(apps, schema_editor):
+    DocumentCompletion = apps.get_model('server', 'DocumentCompletion')
+    for model_name in ANNOTATION_MODELS:
+        annotations = apps.get_model('server', model_name).objects.order_by()
+        rows = annotations.values_list('document__project', 'document', 'user').annotate(models.Count('id'))
+        for chunk in chunked(rows.iterator(), 1000):
+            DocumentCompletion.objects.bulk_create(
+                DocumentCompletion(project_id=project_id, document_id=document_id, user_id=user_id, annotations=count)
+                for project_id, document_id, user_id, count in chunk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('server', '0009_annotationcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentCompletion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annotations', models.IntegerField(default=0)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completions', to='server.Document')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completions', to='server.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documentcompletion',
+            index=models.Index(fields=['project', 'user'], name='server_docu_project_c2d594_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentcompletion',
+            unique_together={('document', 'user')},
+        ),
+        migrations.RunPython(complete_documents, migrations.RunPython.noop),
+    ]
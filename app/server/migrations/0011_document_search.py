@@ -0,0 +1,24 @@
+# Generated by Django 2.1.7 on 2026-10-18 03:05
+
+from django.db import migrations
+
+from server.search import create_search_index, drop_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0010_documentcompletion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.1.7 on 2026-10-18 03:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from server.utils import chunked
+
+
+def queue_documents(apps, schema_editor):
+    Document = apps.get_model('server', 'Document')
+    WorkItem = apps.get_model('server', 'WorkItem')
+    documents = Document.objects.filter(completions__isnull=True).order_by('id').values_list('project', 'id')
+    for chunk in chunked(documents.iterator(), 1000):
+        WorkItem.objects.bulk_create(WorkItem(project_id=project_id, document_id=document_id)
+                                     for project_id, document_id in chunk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('server', '0011_document_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='work_item', to='server.Document')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='work_items', to='server.Project')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='workitem',
+            index=models.Index(fields=['project', 'expires_at'], name='server_work_project_1b3b89_idx'),
+        ),
+        migrations.RunPython(queue_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.1.7 on 2026-10-18 03:14
+
+from django.db import migrations, models
+
+ANNOTATION_MODELS = ('DocumentAnnotation', 'SequenceAnnotation', 'Seq2seqAnnotation')
+
+
+def mark_manual(apps, schema_editor):
+    # every annotation so far was written by an annotator or imported
+    for model_name in ANNOTATION_MODELS:
+        apps.get_model('server', model_name).objects.filter(manual=False).update(manual=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0012_workitem'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentannotation',
+            name='manual',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='seq2seqannotation',
+            name='manual',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='sequenceannotation',
+            name='manual',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_manual, migrations.RunPython.noop),
+    ]
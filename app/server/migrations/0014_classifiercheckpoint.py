@@ -0,0 +1,25 @@
+# Generated by Django 2.1.7 on 2026-10-18 03:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0013_manual_annotations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassifierCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_path', models.CharField(blank=True, default='', max_length=500)),
+                ('last_annotation_id', models.IntegerField(default=0)),
+                ('annotations_trained', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='classifier_checkpoint', to='server.Project')),
+            ],
+        ),
+    ]
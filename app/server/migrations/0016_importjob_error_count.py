@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0015_importjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='error_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2026-10-18 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0016_importjob_error_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportsnapshot',
+            name='stale_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
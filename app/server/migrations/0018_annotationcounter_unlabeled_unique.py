@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+INDEX_NAME = 'server_annotationcounter_unlabeled'
+
+
+def merge_unlabeled_counters(apps, schema_editor):
+    # concurrent writes may have counted seq2seq annotations in several rows
+    AnnotationCounter = apps.get_model('server', 'AnnotationCounter')
+    counters = AnnotationCounter.objects.filter(label__isnull=True).order_by()
+    duplicated = counters.values('project', 'user').annotate(rows=models.Count('id'), total=models.Sum('count')) \
+                         .filter(rows__gt=1)
+    for row in duplicated:
+        keys = counters.filter(project=row['project'], user=row['user']).order_by('id').values_list('id', flat=True)
+        kept, *merged = keys
+        AnnotationCounter.objects.filter(id=kept).update(count=row['total'])
+        AnnotationCounter.objects.filter(id__in=merged).delete()
+
+
+def create_index(apps, schema_editor):
+    # Both support partial indexes; on other databases the counters of
+    # seq2seq projects stay unconstrained.
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('CREATE UNIQUE INDEX {} ON server_annotationcounter (project_id, user_id) '
+                              'WHERE label_id IS NULL'.format(INDEX_NAME))
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0017_exportsnapshot_stale_since'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_unlabeled_counters, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+def reset_checkpoints(apps, schema_editor):
+    # the checkpoints knew which annotations they learned by id, so every
+    # classifier learns all annotations again on its next run
+    apps.get_model('server', 'ClassifierCheckpoint').objects.update(file_path='', annotations_trained=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('server', '0018_annotationcounter_unlabeled_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='seq2seqannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='sequenceannotation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RemoveField(
+            model_name='classifiercheckpoint',
+            name='last_annotation_id',
+        ),
+        migrations.AddField(
+            model_name='classifiercheckpoint',
+            name='trained_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(reset_checkpoints, migrations.RunPython.noop),
+    ]
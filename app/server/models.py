@@ -1,10 +1,19 @@
 import json
+import os
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.contrib.staticfiles.storage import staticfiles_storage
-from .utils import get_key_choices
+from .utils import get_key_choices, get_content_hash
 
 from django.urls import reverse, path
 from django.http import HttpResponse, HttpResponseRedirect
@@ -37,10 +46,9 @@ class Project(models.Model):
         return project_type == self.project_type
 
     def get_progress(self, user):
-        docs = self.get_documents(is_null=True, user=user)
         total = self.documents.count()
-        remaining = docs.count()
-        return {'total': total, 'remaining': remaining}
+        completed = self.completions.filter(user=user).count()
+        return {'total': total, 'remaining': total - completed}
 
     @property
     def image(self):
@@ -139,6 +147,35 @@ class Label(models.Model):
     def __str__(self):
         return self.text
 
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        renamed = self.pk is not None and Label.objects.filter(pk=self.pk).exclude(text=self.text).exists()
+        super(Label, self).save(*args, **kwargs)
+        # the annotation page shows the labels of the project
+        Project.objects.filter(pk=self.project_id).update(updated_at=timezone.now())
+        if renamed:
+            self.touch_documents()
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        # the label's counters go with it, but its annotations complete documents
+        DocumentCompletion.remove_annotations(self.project_id, self.get_annotations())
+        self.touch_documents()
+        Project.objects.filter(pk=self.project_id).update(updated_at=timezone.now())
+        return super(Label, self).delete(*args, **kwargs)
+
+    def get_annotations(self):
+        annotation_class = self.project.get_annotation_class()
+        if self.project.is_type_of(Project.Seq2seq):
+            return annotation_class.objects.none()
+        return annotation_class.objects.filter(label=self)
+
+    def touch_documents(self):
+        # label names are part of every exported annotation of the label
+        annotations = self.get_annotations()
+        Document.objects.filter(id__in=annotations.values('document')).update(updated_at=timezone.now())
+        ExportSnapshot.mark_stale(self.project_id)
+
     class Meta:
         unique_together = (
             ('project', 'text'),
@@ -150,6 +187,26 @@ class Document(models.Model):
     text = models.TextField()
     project = models.ForeignKey(Project, related_name='documents', on_delete=models.CASCADE)
     metadata = models.TextField(default='{}')
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'content_hash']),
+            models.Index(fields=['project', 'updated_at']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.content_hash = get_content_hash(self.text)
+        super(Document, self).save(*args, **kwargs)
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        # completions and work items go with the document, counters are per label
+        AnnotationCounter.remove_annotations(self.project, self.get_annotations())
+        result = super(Document, self).delete(*args, **kwargs)
+        ExportSnapshot.mark_stale(self.project_id)
+        return result
 
     def get_annotations(self):
         if self.project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
@@ -159,25 +216,25 @@ class Document(models.Model):
         elif self.project.is_type_of(Project.Seq2seq):
             return self.seq2seq_annotations.all()
 
-    def to_csv(self):
-        return self.make_dataset()
+    def to_csv(self, annotations=None):
+        return self.make_dataset(annotations)
 
-    def make_dataset(self):
+    def make_dataset(self, annotations=None):
+        if annotations is None:
+            annotations = self.get_annotations()
         if self.project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
-            return self.make_dataset_for_classification()
+            return self.make_dataset_for_classification(annotations)
         elif self.project.is_type_of(Project.SEQUENCE_LABELING):
-            return self.make_dataset_for_sequence_labeling()
+            return self.make_dataset_for_sequence_labeling(annotations)
         elif self.project.is_type_of(Project.Seq2seq):
-            return self.make_dataset_for_seq2seq()
+            return self.make_dataset_for_seq2seq(annotations)
 
-    def make_dataset_for_classification(self):
-        annotations = self.get_annotations()
+    def make_dataset_for_classification(self, annotations):
         dataset = [[self.id, self.text, a.label.text, a.user.username, self.metadata]
                    for a in annotations]
         return dataset
 
-    def make_dataset_for_sequence_labeling(self):
-        annotations = self.get_annotations()
+    def make_dataset_for_sequence_labeling(self, annotations):
         label_list = list()
         for a in annotations:
             label_list.append([a.start_offset, a.end_offset, a.label.text])
@@ -185,42 +242,40 @@ class Document(models.Model):
         dataset = [self.text, label_list, self.metadata]
         return dataset
 
-    def make_dataset_for_seq2seq(self):
-        annotations = self.get_annotations()
+    def make_dataset_for_seq2seq(self, annotations):
         dataset = [[self.id, self.text, a.text, a.user.username, self.metadata]
                    for a in annotations]
         return dataset
 
-    def to_json(self):
-        return self.make_dataset_json()
+    def to_json(self, annotations=None):
+        return self.make_dataset_json(annotations)
 
-    def make_dataset_json(self):
+    def make_dataset_json(self, annotations=None):
+        if annotations is None:
+            annotations = self.get_annotations()
         if self.project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
-            return self.make_dataset_for_classification_json()
+            return self.make_dataset_for_classification_json(annotations)
         elif self.project.is_type_of(Project.SEQUENCE_LABELING):
-            return self.make_dataset_for_sequence_labeling_json()
+            return self.make_dataset_for_sequence_labeling_json(annotations)
         elif self.project.is_type_of(Project.Seq2seq):
-            return self.make_dataset_for_seq2seq_json()
+            return self.make_dataset_for_seq2seq_json(annotations)
 
-    def make_dataset_for_classification_json(self):
-        annotations = self.get_annotations()
+    def make_dataset_for_classification_json(self, annotations):
         labels = [a.label.text for a in annotations]
-        username = annotations[0].user.username
+        username = annotations[0].user.username if annotations else None
         dataset = {'doc_id': self.id, 'text': self.text, 'labels': labels, 'username': username, 'metadata': json.loads(self.metadata)}
         return dataset
 
-    def make_dataset_for_sequence_labeling_json(self):
-        annotations = self.get_annotations()
+    def make_dataset_for_sequence_labeling_json(self, annotations):
         entities = [(a.start_offset, a.end_offset, a.label.text) for a in annotations]
         # username = annotations[0].user.username
         # dataset = {'doc_id': self.id, 'text': self.text, 'labels': entities, 'username': username, 'metadata': json.loads(self.metadata)}
         dataset = {'text': self.text, 'labels': entities, 'metadata': json.loads(self.metadata)}
         return dataset
 
-    def make_dataset_for_seq2seq_json(self):
-        annotations = self.get_annotations()
+    def make_dataset_for_seq2seq_json(self, annotations):
         sentences = [a.text for a in annotations]
-        username = annotations[0].user.username
+        username = annotations[0].user.username if annotations else None
         dataset = {'doc_id': self.id, 'text': self.text, 'sentences': sentences, 'username': username, 'metadata': json.loads(self.metadata)}
         return dataset
 
@@ -230,12 +285,55 @@ class Document(models.Model):
 
 class Annotation(models.Model):
     prob = models.FloatField(default=0.0)
-    manual = models.BooleanField(default=False)
+    manual = models.BooleanField(default=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         abstract = True
 
+    # The counters, completions and snapshots are updated here rather than in
+    # signal receivers, since receivers would make deleting documents, labels
+    # and projects load and signal every annotation. Bulk writes update them
+    # themselves, and so do Document.delete and Label.delete.
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        counts, completions = Counter(), Counter()
+        if self.pk is not None:
+            stored = type(self).objects.select_for_update().filter(pk=self.pk).first()
+            if stored is not None:
+                counts[stored.get_counter_key()] -= 1
+                completions[stored.get_completion_key()] -= 1
+        super(Annotation, self).save(*args, **kwargs)
+        counts[self.get_counter_key()] += 1
+        completions[self.get_completion_key()] += 1
+        self.update_counters(counts, completions)
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        deleted, rows = super(Annotation, self).delete(*args, **kwargs)
+        if deleted:
+            self.update_counters({self.get_counter_key(): -1}, {self.get_completion_key(): -1})
+        return deleted, rows
+
+    def update_counters(self, counts, completions):
+        # callers pass annotations with their document, so it is not read again
+        project_id = self.document.project_id
+        AnnotationCounter.add(project_id, counts)
+        DocumentCompletion.add(project_id, completions)
+        Document.objects.filter(pk=self.document_id).update(updated_at=timezone.now())
+        ExportSnapshot.mark_stale(project_id)
+
+    def get_counter_key(self):
+        return self.__dict__.get('label_id'), self.__dict__.get('user_id')
+
+    def get_completion_key(self):
+        # machine suggestions complete nothing until somebody confirms them
+        if not self.__dict__.get('manual'):
+            return None
+        return self.__dict__.get('document_id'), self.__dict__.get('user_id')
+
 
 class DocumentAnnotation(Annotation):
     document = models.ForeignKey(Document, related_name='doc_annotations', on_delete=models.CASCADE)
@@ -265,3 +363,299 @@ class Seq2seqAnnotation(Annotation):
 
     class Meta:
         unique_together = ('document', 'user', 'text')
+
+
+class ImportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+
+    ALLOW_DUPLICATES = 'allow'
+    SKIP_DUPLICATES = 'skip'
+    UPDATE_DUPLICATES = 'update'
+
+    DUPLICATES_CHOICES = (
+        (ALLOW_DUPLICATES, 'import duplicates'),
+        (SKIP_DUPLICATES, 'skip duplicates'),
+        (UPDATE_DUPLICATES, 'update metadata of duplicates'),
+    )
+
+    project = models.ForeignKey(Project, related_name='import_jobs', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_path = models.CharField(max_length=255)
+    file_format = models.CharField(max_length=10)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    rows_parsed = models.IntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    rows_duplicated = models.IntegerField(default=0)
+    duplicates = models.CharField(max_length=10, choices=DUPLICATES_CHOICES, default=ALLOW_DUPLICATES)
+    errors = models.TextField(default='[]')
+    error_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def throughput(self):
+        if not self.started_at:
+            return 0.0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return self.rows_inserted / elapsed if elapsed > 0 else 0.0
+
+    def add_error(self, message):
+        errors = json.loads(self.errors)
+        errors.append(message)
+        self.errors = json.dumps(errors)
+        self.error_count += 1
+
+    def __str__(self):
+        return '{} ({})'.format(os.path.basename(self.file_path), self.status)
+
+
+class ChunkedUpload(models.Model):
+    project = models.ForeignKey(Project, related_name='chunked_uploads', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    checksum = models.CharField(max_length=64, blank=True, default='')
+    duplicates = models.CharField(max_length=10, choices=ImportJob.DUPLICATES_CHOICES,
+                                  default=ImportJob.ALLOW_DUPLICATES)
+    job = models.OneToOneField(ImportJob, null=True, blank=True, on_delete=models.SET_NULL)
+    key = models.UUIDField(default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    @property
+    def file_format(self):
+        return self.file_name.split('.')[-1]
+
+    def get_chunk_size(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - self.chunk_size * index
+        return self.chunk_size
+
+    def __str__(self):
+        return self.file_name
+
+
+class ExportSnapshot(models.Model):
+    JSON = 'json'
+    CSV = 'csv'
+    EXCEL = 'excel'
+    PARQUET = 'parquet'
+
+    FORMAT_CHOICES = (
+        (JSON, 'JSON'),
+        (CSV, 'CSV'),
+        (EXCEL, 'Excel'),
+        (PARQUET, 'Parquet'),
+    )
+
+    project = models.ForeignKey(Project, related_name='export_snapshots', on_delete=models.CASCADE)
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    labeled_only = models.BooleanField(default=True)
+    file_path = models.CharField(max_length=500, blank=True, default='')
+    index_path = models.CharField(max_length=500, blank=True, default='')
+    size = models.BigIntegerField(default=0)
+    is_stale = models.BooleanField(default=True, db_index=True)
+    stale_since = models.DateTimeField(null=True, blank=True)
+    documents_rewritten = models.IntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('project', 'export_format', 'labeled_only')
+
+    @classmethod
+    def mark_stale(cls, project_id):
+        cls.objects.filter(project_id=project_id, is_stale=False).update(is_stale=True, stale_since=timezone.now())
+
+    def __str__(self):
+        return '{} ({})'.format(self.project, self.export_format)
+
+
+class AnnotationCounter(models.Model):
+    """Number of annotations per project, label and user."""
+    project = models.ForeignKey(Project, related_name='annotation_counters', on_delete=models.CASCADE)
+    label = models.ForeignKey(Label, null=True, blank=True, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        # Counters of seq2seq projects have no label, and unique constraints
+        # don't apply to NULLs, so migration 0018 adds a partial unique index
+        # on (project, user) for them. SQLite migrations which rebuild the
+        # table drop it, and must create it again.
+        unique_together = ('project', 'label', 'user')
+
+    @classmethod
+    def add(cls, project_id, counts):
+        """Adds the ``{(label_id, user_id): delta}`` counts to a project's counters."""
+        for (label_id, user_id), delta in counts.items():
+            if not delta:
+                continue
+            counters = cls.objects.filter(project_id=project_id, label_id=label_id, user_id=user_id)
+            if counters.update(count=F('count') + delta) or delta < 0:
+                # counters of deleted labels and users are gone with them
+                continue
+            counter, created = cls.objects.get_or_create(project_id=project_id, label_id=label_id,
+                                                         user_id=user_id, defaults={'count': delta})
+            if not created:
+                counters.update(count=F('count') + delta)
+
+    @classmethod
+    def remove_annotations(cls, project, annotations):
+        """Takes a queryset of annotations off the counters, before they are deleted."""
+        cls.add(project.id, {(label_id, user_id): -count
+                             for label_id, user_id, count in cls.count_annotations(project, annotations)})
+
+    @classmethod
+    @transaction.atomic
+    def recount(cls, project):
+        """Rebuilds a project's counters from its annotations."""
+        cls.objects.filter(project=project).delete()
+        annotations = project.get_annotation_class().objects.filter(document__project=project)
+        cls.objects.bulk_create(cls(project=project, label_id=label_id, user_id=user_id, count=count)
+                                for label_id, user_id, count in cls.count_annotations(project, annotations))
+
+    @staticmethod
+    def count_annotations(project, annotations):
+        """Returns ``(label_id, user_id, count)`` rows of a queryset of annotations."""
+        annotations = annotations.order_by()
+        if project.is_type_of(Project.Seq2seq):
+            return [(None, user_id, count) for user_id, count in
+                    annotations.values_list('user').annotate(models.Count('id'))]
+        return list(annotations.values_list('label', 'user').annotate(models.Count('id')))
+
+    def __str__(self):
+        return '{}: {}'.format(self.project, self.count)
+
+
+class DocumentCompletion(models.Model):
+    """A document annotated by a user, with the number of their annotations on it."""
+    project = models.ForeignKey(Project, related_name='completions', on_delete=models.CASCADE)
+    document = models.ForeignKey(Document, related_name='completions', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    annotations = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('document', 'user')
+        indexes = [
+            models.Index(fields=['project', 'user']),
+        ]
+
+    @classmethod
+    def add(cls, project_id, counts):
+        """Adds the ``{(document_id, user_id): delta}`` annotation counts, removing
+        the completions that have no annotations left."""
+        for key, delta in counts.items():
+            if key is None:
+                continue
+            document_id, user_id = key
+            completions = cls.objects.filter(document_id=document_id, user_id=user_id)
+            if delta > 0:
+                if completions.update(annotations=F('annotations') + delta):
+                    continue
+                completion, created = cls.objects.get_or_create(project_id=project_id, document_id=document_id,
+                                                                user_id=user_id, defaults={'annotations': delta})
+                if not created:
+                    completions.update(annotations=F('annotations') + delta)
+                else:
+                    # an annotated document leaves the work queue
+                    WorkItem.objects.filter(document_id=document_id).delete()
+            elif delta < 0:
+                completions.update(annotations=F('annotations') + delta)
+                if completions.filter(annotations__lte=0).delete()[0] and \
+                        not cls.objects.filter(document_id=document_id).exists():
+                    WorkItem.queue(project_id, document_id)
+
+    @classmethod
+    def remove_annotations(cls, project_id, annotations):
+        """Takes a queryset of annotations off the completions in bulk, before they
+        are deleted, and queues the documents nobody has annotated any more."""
+        annotations = annotations.filter(manual=True).order_by()
+        removed = annotations.filter(document=OuterRef('document'), user=OuterRef('user')) \
+                             .values('document').annotate(count=models.Count('id')).values('count')
+        completions = cls.objects.filter(project_id=project_id, document__in=annotations.values('document'))
+        completions.update(annotations=F('annotations') - Coalesce(Subquery(removed), 0))
+        completions.filter(annotations__lte=0).delete()
+
+        completed = cls.objects.filter(project_id=project_id).values('document')
+        queued = WorkItem.objects.filter(project_id=project_id).values('document')
+        unannotated = Document.objects.filter(id__in=annotations.values('document')) \
+                                      .exclude(id__in=completed).exclude(id__in=queued)
+        WorkItem.objects.bulk_create(WorkItem(project_id=project_id, document_id=document_id)
+                                     for document_id in unannotated.values_list('id', flat=True))
+
+    def __str__(self):
+        return '{}: {}'.format(self.document, self.user)
+
+
+class WorkItem(models.Model):
+    """A document nobody has annotated yet, leased to one annotator at a time."""
+    project = models.ForeignKey(Project, related_name='work_items', on_delete=models.CASCADE)
+    document = models.OneToOneField(Document, related_name='work_item', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'expires_at']),
+        ]
+
+    @classmethod
+    def queue(cls, project_id, document_id):
+        try:
+            with transaction.atomic():
+                cls.objects.create(project_id=project_id, document_id=document_id)
+        except IntegrityError:
+            # queued by a concurrent request
+            pass
+
+    @classmethod
+    def lease(cls, project, user, limit):
+        """Leases up to ``limit`` documents to a user, renewing the leases they
+        already hold. Returns the expiry and the ids of the leased documents."""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=settings.WORK_LEASE_SECONDS)
+        # expired leases go back to the queue in one update
+        cls.objects.filter(project=project, expires_at__lt=now).update(user=None, expires_at=None)
+        leased = cls.objects.filter(project=project, user=user)
+        count = leased.update(expires_at=expires_at)
+        while count < limit:
+            free = list(cls.objects.filter(project=project, expires_at=None)
+                                   .order_by('id')
+                                   .values_list('id', flat=True)[:limit - count])
+            if not free:
+                break
+            # items leased by somebody else in the meantime are skipped
+            count += cls.objects.filter(id__in=free, expires_at=None).update(user=user, expires_at=expires_at)
+
+        return expires_at, list(leased.order_by('id').values_list('document', flat=True))
+
+    def __str__(self):
+        return '{}: {}'.format(self.document, self.user)
+
+
+class ClassifierCheckpoint(models.Model):
+    """State of a project's incrementally trained classifier, kept in a file."""
+    project = models.OneToOneField(Project, related_name='classifier_checkpoint', on_delete=models.CASCADE)
+    file_path = models.CharField(max_length=500, blank=True, default='')
+    trained_until = models.DateTimeField(null=True, blank=True)
+    annotations_trained = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}: {} annotations'.format(self.project, self.annotations_trained)
@@ -0,0 +1,57 @@
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+def get_cached_count(queryset):
+    """Counts a queryset, reusing the count of the same query for a while."""
+    sql, params = queryset.query.sql_with_params()
+    key = 'count:{}'.format(hashlib.md5('{}{}'.format(sql, params).encode('utf-8')).hexdigest())
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.DOCUMENT_COUNT_CACHE_SECONDS)
+
+    return count
+
+
+class DocumentCursorPagination(CursorPagination):
+    """Keyset pagination on document id.
+
+    Pages are fetched with ``id > last id`` on the primary key index, so
+    their cost does not grow with the position. Counting every matching
+    document is optional (``count=true``) and cached.
+    """
+    ordering = 'id'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # full-text search results are paged by relevance, then id
+        if 'rank' in queryset.query.annotations and 'ordering' not in request.query_params:
+            return ('rank', 'id')
+        return super(DocumentCursorPagination, self).get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get('count') == 'true':
+            self.count = get_cached_count(queryset)
+
+        return super(DocumentCursorPagination, self).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class DocumentWindowPagination(DocumentCursorPagination):
+    """Larger pages of documents, for clients that prefetch the next one."""
+    page_size = 20
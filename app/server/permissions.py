@@ -5,14 +5,35 @@ from rest_framework.permissions import BasePermission, SAFE_METHODS, IsAdminUser
 from .models import Project
 
 
+def get_project(request, project_id):
+    """Returns the project a request is about, loading it once per request."""
+    projects = request.__dict__.setdefault('_projects', {})
+    if project_id not in projects:
+        projects[project_id] = get_object_or_404(Project, pk=project_id)
+
+    return projects[project_id]
+
+
+def is_project_member(request, project_id):
+    """Tells whether the user of a request is a member of a project, checking once per request.
+
+    The answer is not kept across requests, since the processes serving them
+    would not see membership changes made by each other.
+    """
+    members = request.__dict__.setdefault('_project_members', {})
+    if project_id not in members:
+        members[project_id] = Project.users.through.objects.filter(project_id=project_id,
+                                                                   user_id=request.user.id).exists()
+
+    return members[project_id]
+
+
 class IsProjectUser(BasePermission):
 
     def has_permission(self, request, view):
-        user = request.user
-        project_id = view.kwargs.get('project_id')
-        project = get_object_or_404(Project, pk=project_id)
+        project = get_project(request, view.kwargs.get('project_id'))
 
-        return user in project.users.all()
+        return is_project_member(request, project.id)
 
 
 class IsAdminUserAndWriteOnly(BasePermission):
@@ -27,14 +48,11 @@ class IsAdminUserAndWriteOnly(BasePermission):
 class IsOwnAnnotation(BasePermission):
 
     def has_permission(self, request, view):
-        user = request.user
-        project_id = view.kwargs.get('project_id')
-        annotation_id = view.kwargs.get('annotation_id')
-        project = get_object_or_404(Project, pk=project_id)
-        Annotation = project.get_annotation_class()
-        annotation = Annotation.objects.get(id=annotation_id)
-
-        return annotation.user == user
+        project = get_project(request, view.kwargs.get('project_id'))
+        annotations = project.get_annotation_class().objects.filter(id=view.kwargs.get('annotation_id'))
+        owner_id = get_object_or_404(annotations.values_list('user_id', flat=True))
+
+        return owner_id == request.user.id
 
 
 class SuperUserMixin(UserPassesTestMixin):
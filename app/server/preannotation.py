@@ -0,0 +1,217 @@
+import os
+import pickle
+import tempfile
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, FloatField, Value, When
+from django.utils import timezone
+
+from .models import AnnotationCounter, ClassifierCheckpoint, Document, DocumentAnnotation, ExportSnapshot, Project
+
+# The calibration of the classifier is cross-validated over this many folds,
+# so every label needs at least as many manual annotations.
+MIN_LABEL_EXAMPLES = 3
+
+
+class PreannotationError(Exception):
+    def __init__(self, message):
+        super(PreannotationError, self).__init__(message)
+        self.message = message
+
+
+def get_trained_label_ids(project):
+    """Returns the ids of the labels with enough manual annotations to train on."""
+    label_ids = set(DocumentAnnotation.objects.filter(document__project=project, manual=True)
+                                              .order_by()
+                                              .values('label')
+                                              .annotate(examples=Count('id'))
+                                              .filter(examples__gte=MIN_LABEL_EXAMPLES)
+                                              .values_list('label', flat=True))
+    if len(label_ids) < 2:
+        raise PreannotationError('At least two labels need {} manual annotations each'.format(MIN_LABEL_EXAMPLES))
+    return label_ids
+
+
+def get_training_data(project):
+    """Returns the texts and label ids of a project's manual annotations,
+    leaving out labels with too few of them to train on."""
+    label_ids = get_trained_label_ids(project)
+    rows = DocumentAnnotation.objects.filter(document__project=project, manual=True, label__in=label_ids) \
+                                     .order_by('id') \
+                                     .values_list('document__text', 'label')
+    texts, label_ids = zip(*rows)
+    return list(texts), list(label_ids)
+
+
+def train_classifier(texts, label_ids):
+    # scikit-learn is only needed by pre-annotation
+    from classifier.model import build_model
+    from classifier.preprocess import build_vectorizer
+
+    vectorizer = build_vectorizer()
+    model = build_model(cv=MIN_LABEL_EXAMPLES)
+    model.fit(vectorizer.fit_transform(texts), label_ids)
+
+    return vectorizer, model
+
+
+def load_classifier(checkpoint):
+    if not checkpoint.file_path or not os.path.exists(checkpoint.file_path):
+        return None
+    with open(checkpoint.file_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_classifier(checkpoint, vectorizer, model):
+    os.makedirs(settings.CLASSIFIER_CHECKPOINT_DIR, exist_ok=True)
+    file_path = os.path.join(settings.CLASSIFIER_CHECKPOINT_DIR, 'project-{}.pickle'.format(checkpoint.project_id))
+    with tempfile.NamedTemporaryFile(dir=settings.CLASSIFIER_CHECKPOINT_DIR, delete=False) as f:
+        pickle.dump((vectorizer, model), f)
+    os.replace(f.name, file_path)
+    checkpoint.file_path = file_path
+
+
+@transaction.atomic
+def update_classifier(project, batch_size):
+    """Trains the project's online classifier on the manual annotations written
+    or confirmed since its checkpoint, and returns its vectorizer and model.
+
+    Annotations deleted after they were learned are not unlearned, and
+    relabeled ones are learned again with their new label. When labels are
+    added or removed, the classifier learns all annotations again.
+    """
+    from classifier.model import build_online_model
+    from classifier.preprocess import build_hashing_vectorizer
+
+    get_trained_label_ids(project)
+    ClassifierCheckpoint.objects.get_or_create(project=project)
+    # concurrent runs for the same project wait for each other
+    checkpoint = ClassifierCheckpoint.objects.select_for_update().get(project=project)
+    label_ids = sorted(project.labels.values_list('id', flat=True))
+    state = load_classifier(checkpoint)
+    if state is None or [int(label_id) for label_id in state[1].classes_] != label_ids:
+        state = build_hashing_vectorizer(), build_online_model()
+        checkpoint.trained_until, checkpoint.annotations_trained = None, 0
+
+    vectorizer, model = state
+    trained_until = timezone.now()
+    annotations = DocumentAnnotation.objects.filter(document__project=project, manual=True,
+                                                    updated_at__lte=trained_until).order_by('id')
+    if checkpoint.trained_until is not None:
+        annotations = annotations.filter(updated_at__gt=checkpoint.trained_until)
+    last_id = trained = 0
+    while True:
+        batch = list(annotations.filter(id__gt=last_id).values_list('id', 'document__text', 'label')[:batch_size])
+        if not batch:
+            break
+        annotation_ids, texts, batch_label_ids = zip(*batch)
+        model.partial_fit(vectorizer.transform(texts), batch_label_ids, classes=label_ids)
+        last_id = annotation_ids[-1]
+        trained += len(batch)
+
+    checkpoint.trained_until = trained_until
+    if trained:
+        checkpoint.annotations_trained += trained
+        save_classifier(checkpoint, vectorizer, model)
+    checkpoint.save()
+
+    return vectorizer, model
+
+
+def get_annotated_documents(project, user):
+    """Returns the annotations other than the user's suggestions, which are scored again."""
+    return DocumentAnnotation.objects.filter(document__project=project).exclude(user=user, manual=False)
+
+
+def iter_unlabeled_documents(project, user, batch_size):
+    """Yields batches of ``(id, text)`` of the documents nobody annotated yet,
+    including those that only carry suggestions for the user."""
+    annotated = get_annotated_documents(project, user).values('document')
+    documents = Document.objects.filter(project=project).exclude(id__in=annotated).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(documents.filter(id__gt=last_id).values_list('id', 'text')[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+@transaction.atomic
+def save_suggestions(project, user, documents, vectorizer, model):
+    """Labels a batch of ``(id, text)`` documents with the most probable label,
+    as machine annotations of the user, and returns the number of documents
+    whose suggested label is new.
+
+    Suggestions made before are replaced when the label changes, and only
+    their probability is updated otherwise.
+    """
+    document_ids, texts = zip(*documents)
+    suggestions = {}
+    for annotation in DocumentAnnotation.objects.select_for_update().filter(document_id__in=document_ids,
+                                                                            user=user, manual=False):
+        suggestions.setdefault(annotation.document_id, []).append(annotation)
+    # documents annotated or confirmed since they were read are left alone
+    annotated = set(get_annotated_documents(project, user).filter(document_id__in=document_ids)
+                                                          .values_list('document_id', flat=True))
+
+    probabilities = model.predict_proba(vectorizer.transform(texts))
+    best = probabilities.argmax(axis=1)
+    created, deleted, rescored = [], [], []
+    for document_id, probability, index in zip(document_ids, probabilities, best):
+        if document_id in annotated:
+            continue
+        label_id, prob = int(model.classes_[index]), float(probability[index])
+        stored = suggestions.get(document_id, [])
+        kept = next((annotation for annotation in stored if annotation.label_id == label_id), None)
+        deleted += [annotation for annotation in stored if annotation is not kept]
+        if kept is None:
+            created.append(DocumentAnnotation(document_id=document_id, label_id=label_id, user=user,
+                                              prob=prob, manual=False))
+        elif kept.prob != prob:
+            kept.prob = prob
+            rescored.append(kept)
+
+    DocumentAnnotation.objects.filter(id__in=[annotation.id for annotation in deleted]).delete()
+    created = DocumentAnnotation.objects.bulk_create(created)
+    if rescored:
+        cases = [When(id=annotation.id, then=Value(annotation.prob)) for annotation in rescored]
+        DocumentAnnotation.objects.filter(id__in=[annotation.id for annotation in rescored]) \
+                                  .update(prob=Case(*cases, output_field=FloatField()))
+
+    # Suggestions complete no document, so only the label counters change.
+    counts = Counter(annotation.get_counter_key() for annotation in created)
+    counts.subtract(annotation.get_counter_key() for annotation in deleted)
+    AnnotationCounter.add(project.id, counts)
+    changed = {annotation.document_id for annotation in created + deleted + rescored}
+    if changed:
+        Document.objects.filter(id__in=changed).update(updated_at=timezone.now())
+        ExportSnapshot.mark_stale(project.id)
+
+    return len(created)
+
+
+def preannotate(project, user, batch_size=None, incremental=False):
+    """Trains a classifier on the manual annotations of a document classification
+    project and suggests a label for each of its unlabeled documents.
+    Returns the number of new suggestions; the suggestions already made are
+    scored again.
+
+    The incremental classifier only learns the annotations written or
+    confirmed since the last incremental run, so that it can be updated often.
+    """
+    if not project.is_type_of(Project.DOCUMENT_CLASSIFICATION):
+        raise PreannotationError('Only document classification projects can be pre-annotated')
+
+    batch_size = batch_size or settings.PREANNOTATION_BATCH_SIZE
+    if incremental:
+        vectorizer, model = update_classifier(project, batch_size)
+    else:
+        vectorizer, model = train_classifier(*get_training_data(project))
+    count = 0
+    for batch in iter_unlabeled_documents(project, user, batch_size):
+        count += save_suggestions(project, user, batch, vectorizer, model)
+
+    return count
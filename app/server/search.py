@@ -0,0 +1,118 @@
+import logging
+
+from django.db import OperationalError, connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+logger = logging.getLogger(__name__)
+
+SQLITE_TABLE = 'server_document_fts'
+POSTGRES_INDEX = 'server_document_text_search'
+# Trigram tokens match substrings, like the LIKE search they replace, but
+# need terms of at least three characters.
+SQLITE_MIN_TERM_LENGTH = 3
+
+SQLITE_CREATE = [
+    """CREATE VIRTUAL TABLE {table} USING fts5(
+           text, content='server_document', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER {table}_insert AFTER INSERT ON server_document BEGIN
+           INSERT INTO {table}(rowid, text) VALUES (new.id, new.text);
+       END""",
+    """CREATE TRIGGER {table}_delete AFTER DELETE ON server_document BEGIN
+           INSERT INTO {table}({table}, rowid, text) VALUES ('delete', old.id, old.text);
+       END""",
+    """CREATE TRIGGER {table}_update AFTER UPDATE OF text ON server_document BEGIN
+           INSERT INTO {table}({table}, rowid, text) VALUES ('delete', old.id, old.text);
+           INSERT INTO {table}(rowid, text) VALUES (new.id, new.text);
+       END""",
+    """INSERT INTO {table}({table}) VALUES ('rebuild')""",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS {table}_insert',
+    'DROP TRIGGER IF EXISTS {table}_delete',
+    'DROP TRIGGER IF EXISTS {table}_update',
+    'DROP TABLE IF EXISTS {table}',
+]
+
+
+def create_search_index(schema_editor):
+    """Creates the full-text index of document texts for the database in use.
+
+    SQLite keeps an FTS5 table in sync with triggers, so that bulk inserts
+    and raw deletes are indexed too. Note that SQLite migrations which
+    rebuild server_document drop the triggers, and must create them again.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            for sql in SQLITE_CREATE:
+                schema_editor.execute(sql.format(table=SQLITE_TABLE))
+        except OperationalError as e:
+            # SQLite before 3.34 has no trigram tokenizer; search falls back to LIKE.
+            logger.warning('Full-text search is disabled: %s', e)
+            for sql in SQLITE_DROP:
+                schema_editor.execute(sql.format(table=SQLITE_TABLE))
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE INDEX {} ON server_document USING GIN (to_tsvector('simple', text))"
+                              .format(POSTGRES_INDEX))
+
+
+def drop_search_index(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for sql in SQLITE_DROP:
+            schema_editor.execute(sql.format(table=SQLITE_TABLE))
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(POSTGRES_INDEX))
+
+
+def has_sqlite_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SQLITE_TABLE])
+        return cursor.fetchone() is not None
+
+
+def search_documents(queryset, terms):
+    """Filters documents containing all terms, annotated with a ``rank`` where
+    lower is more relevant. Returns None when no index can serve the terms."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'sqlite':
+        if any(len(term) < SQLITE_MIN_TERM_LENGTH for term in terms) or not has_sqlite_index(connection):
+            return None
+        query = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        where = '"server_document"."id" IN (SELECT rowid FROM {table} WHERE {table} MATCH %s)'
+        rank = ('SELECT bm25({table}) FROM {table} '
+                'WHERE {table} MATCH %s AND rowid = "server_document"."id"')
+    elif connection.vendor == 'postgresql':
+        # every term is matched as a word prefix
+        terms = [term.replace('\\', '') for term in terms]
+        if not all(terms):
+            return None
+        query = ' & '.join("'{}':*".format(term.replace("'", "''")) for term in terms)
+        where = """to_tsvector('simple', "server_document"."text") @@ to_tsquery('simple', %s)"""
+        rank = """-ts_rank(to_tsvector('simple', "server_document"."text"), to_tsquery('simple', %s))"""
+    else:
+        return None
+
+    return queryset.extra(where=[where.format(table=SQLITE_TABLE)], params=[query]) \
+                   .annotate(rank=RawSQL(rank.format(table=SQLITE_TABLE), [query], output_field=FloatField()))
+
+
+class DocumentSearchFilter(filters.SearchFilter):
+    """Searches document texts through the full-text index, most relevant first.
+
+    Falls back to SearchFilter's LIKE search where the index is missing or
+    cannot serve the terms.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        results = search_documents(queryset, terms)
+        if results is None:
+            return super(DocumentSearchFilter, self).filter_queryset(request, queryset, view)
+        if 'ordering' in request.query_params:
+            return results
+        return results.order_by('rank', 'id')
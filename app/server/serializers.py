@@ -1,6 +1,10 @@
+import json
+
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Label, Project, Document
+from .importers import SUPPORTED_FORMATS, get_received_chunks
+from .models import Label, Project, Document, ImportJob, ChunkedUpload
 from .models import DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation
 
 
@@ -35,13 +39,26 @@ class ProjectFilteredPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
             return None
         return queryset.filter(project=view.kwargs['project_id'])
 
+    def to_internal_value(self, data):
+        # bulk writes pass the project's labels in, instead of a query per annotation
+        labels = self.context.get('labels')
+        if labels is None:
+            return super(ProjectFilteredPrimaryKeyRelatedField, self).to_internal_value(data)
+        try:
+            return labels[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
 
 class DocumentAnnotationSerializer(serializers.ModelSerializer):
     label = ProjectFilteredPrimaryKeyRelatedField(queryset=Label.objects.all())
 
     class Meta:
         model = DocumentAnnotation
-        fields = ('id', 'prob', 'label')
+        fields = ('id', 'prob', 'label', 'manual')
+        read_only_fields = ('manual',)
 
     def create(self, validated_data):
         annotation = DocumentAnnotation.objects.create(**validated_data)
@@ -53,7 +70,8 @@ class SequenceAnnotationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = SequenceAnnotation
-        fields = ('id', 'prob', 'label', 'start_offset', 'end_offset')
+        fields = ('id', 'prob', 'label', 'start_offset', 'end_offset', 'manual')
+        read_only_fields = ('manual',)
 
     def create(self, validated_data):
         annotation = SequenceAnnotation.objects.create(**validated_data)
@@ -64,7 +82,20 @@ class Seq2seqAnnotationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Seq2seqAnnotation
-        fields = ('id', 'text')
+        fields = ('id', 'text', 'manual')
+        read_only_fields = ('manual',)
+
+
+class AnnotationBulkSerializer(serializers.Serializer):
+    create = serializers.ListField(child=serializers.DictField(), default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(), default=list)
+
+
+def get_user_annotations(document, related_name, user):
+    # DocumentList prefetches the requesting user's annotations of a whole page
+    if hasattr(document, 'user_annotations'):
+        return document.user_annotations
+    return getattr(document, related_name).filter(user=user)
 
 
 class ClassificationDocumentSerializer(serializers.ModelSerializer):
@@ -73,7 +104,7 @@ class ClassificationDocumentSerializer(serializers.ModelSerializer):
     def get_annotations(self, instance):
         request = self.context.get('request')
         if request:
-            annotations = instance.doc_annotations.filter(user=request.user)
+            annotations = get_user_annotations(instance, 'doc_annotations', request.user)
             serializer = DocumentAnnotationSerializer(annotations, many=True)
             return serializer.data
 
@@ -88,7 +119,7 @@ class SequenceDocumentSerializer(serializers.ModelSerializer):
     def get_annotations(self, instance):
         request = self.context.get('request')
         if request:
-            annotations = instance.seq_annotations.filter(user=request.user)
+            annotations = get_user_annotations(instance, 'seq_annotations', request.user)
             serializer = SequenceAnnotationSerializer(annotations, many=True)
             return serializer.data
 
@@ -103,10 +134,45 @@ class Seq2seqDocumentSerializer(serializers.ModelSerializer):
     def get_annotations(self, instance):
         request = self.context.get('request')
         if request:
-            annotations = instance.seq2seq_annotations.filter(user=request.user)
+            annotations = get_user_annotations(instance, 'seq2seq_annotations', request.user)
             serializer = Seq2seqAnnotationSerializer(annotations, many=True)
             return serializer.data
 
     class Meta:
         model = Document
         fields = ('id', 'text', 'annotations')
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+
+    def to_representation(self, instance):
+        # `errors` can't be declared as a field since it would shadow Serializer.errors.
+        data = super(ImportJobSerializer, self).to_representation(instance)
+        data['errors'] = json.loads(instance.errors)
+        return data
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'status', 'rows_parsed', 'rows_inserted', 'rows_duplicated', 'duplicates',
+                  'error_count', 'throughput', 'created_at', 'started_at', 'finished_at')
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(default=settings.IMPORT_CHUNK_SIZE, min_value=1,
+                                          max_value=settings.IMPORT_MAX_CHUNK_SIZE)
+    received_chunks = serializers.SerializerMethodField()
+
+    def get_received_chunks(self, instance):
+        return get_received_chunks(instance)
+
+    def validate_file_name(self, value):
+        if value.split('.')[-1] not in SUPPORTED_FORMATS:
+            raise serializers.ValidationError('Unsupported file format.')
+        return value
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ('id', 'file_name', 'total_size', 'chunk_size', 'checksum', 'duplicates',
+                  'total_chunks', 'received_chunks', 'job')
+        read_only_fields = ('job',)
+        extra_kwargs = {'total_size': {'min_value': 0}}
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Document, ExportSnapshot, WorkItem
+
+
+@receiver(post_save, sender=Document)
+def document_changed(sender, instance, **kwargs):
+    ExportSnapshot.mark_stale(instance.project_id)
+
+
+@receiver(post_save, sender=Document)
+def queue_document(sender, instance, created, **kwargs):
+    if created:
+        WorkItem.objects.create(project_id=instance.project_id, document=instance)
@@ -28,7 +28,9 @@ const vm = new Vue({
 
     async addLabel(label) {
       const a = this.isIn(label);
-      if (a) {
+      if (a && a.manual === false) {
+        this.confirmLabel(a);
+      } else if (a) {
         this.removeLabel(a);
       } else {
         const docId = this.docs[this.pageNumber].id;
@@ -40,5 +42,17 @@ const vm = new Vue({
         });
       }
     },
+
+    async confirmLabel(annotation) {
+      // posting a suggested label makes it the annotator's own
+      const docId = this.docs[this.pageNumber].id;
+      const payload = {
+        label: annotation.label,
+      };
+      await HTTP.post(`docs/${docId}/annotations/`, payload).then((response) => {
+        const index = this.annotations[this.pageNumber].indexOf(annotation);
+        this.annotations[this.pageNumber].splice(index, 1, response.data);
+      });
+    },
   },
 });
@@ -1,32 +1,32 @@
 import HTTP from './http';
 
-const getOffsetFromUrl = function(url) {
-  const offsetMatch = url.match(/[?#].*offset=(\d+)/);
-  if (offsetMatch == null) {
-    return 0;
+const getCursorFromUrl = function(url) {
+  const cursorMatch = url.match(/[?#].*cursor=([^&]*)/);
+  if (cursorMatch == null) {
+    return '';
   }
 
-  return parseInt(offsetMatch[1], 10);
+  return decodeURIComponent(cursorMatch[1]);
 };
 
-const storeOffsetInUrl = function(offset) {
+const storeCursorInUrl = function(cursor) {
   let href = window.location.href;
+  const value = 'cursor=' + encodeURIComponent(cursor);
 
   const fragmentStart = href.indexOf('#') + 1;
   if (fragmentStart === 0) {
-    href += '#offset=' + offset;
+    href += '#' + value;
   } else {
     const prefix = href.substring(0, fragmentStart);
     const fragment = href.substring(fragmentStart);
 
-    const newFragment = fragment.split('&').map(function(fragmentPart) {
-      const keyValue = fragmentPart.split('=');
-      return keyValue[0] === 'offset'
-        ? 'offset=' + offset
-        : fragmentPart;
-    }).join('&');
+    const fragmentParts = fragment.split('&').filter(function(fragmentPart) {
+      const key = fragmentPart.split('=')[0];
+      return key !== 'cursor' && key !== 'offset' && key !== '';
+    });
+    fragmentParts.push(value);
 
-    href = prefix + newFragment;
+    href = prefix + fragmentParts.join('&');
   }
 
   window.location.href = href;
@@ -41,10 +41,12 @@ const annotationMixin = {
       labels: [],
       guideline: '',
       total: 0,
-      remaining: 0,
+      remainingAtLoad: 0,
+      completedAtLoad: 0,
+      prefetched: null,
       searchQuery: '',
       url: '',
-      offset: getOffsetFromUrl(window.location.href),
+      cursor: getCursorFromUrl(window.location.href),
       picked: 'all',
       count: 0,
       isActive: false,
@@ -79,18 +81,38 @@ const annotationMixin = {
     },
 
     async search() {
-      await HTTP.get(this.url).then((response) => {
-        this.docs = response.data.results;
-        this.next = response.data.next;
-        this.prev = response.data.previous;
-        this.count = response.data.count;
-        this.annotations = [];
-        for (let i = 0; i < this.docs.length; i++) {
-          const doc = this.docs[i];
-          this.annotations.push(doc.annotations);
-        }
-        this.offset = getOffsetFromUrl(this.url);
-      });
+      const prefetched = this.prefetched !== null && this.prefetched.url === this.url;
+      const data = await (prefetched ? this.prefetched.request : this.fetchWindow(this.url));
+      // a prefetched window may predate the annotations made since, so keep counting locally
+      const remaining = prefetched ? this.remaining : data.progress.remaining;
+      this.docs = data.results;
+      this.next = data.next;
+      this.prev = data.previous;
+      this.count = data.count;
+      this.labels = data.labels;
+      this.total = data.progress.total;
+      this.annotations = [];
+      for (let i = 0; i < this.docs.length; i++) {
+        const doc = this.docs[i];
+        this.annotations.push(doc.annotations);
+      }
+      this.remainingAtLoad = remaining;
+      this.completedAtLoad = this.completedOnPage;
+      this.cursor = getCursorFromUrl(this.url);
+
+      // fetch the next window while this one is annotated
+      this.prefetched = null;
+      if (this.next) {
+        const request = this.fetchWindow(this.next);
+        request.catch(() => {
+          this.prefetched = null;
+        });
+        this.prefetched = { url: this.next, request };
+      }
+    },
+
+    fetchWindow(url) {
+      return HTTP.get(url).then(response => response.data);
     },
 
     getState() {
@@ -105,7 +127,9 @@ const annotationMixin = {
 
     async submit() {
       const state = this.getState();
-      this.url = `docs/?q=${this.searchQuery}&is_checked=${state}&offset=${this.offset}`;
+      // documents are paged by id, which stays fast deep into large projects
+      const cursor = encodeURIComponent(this.cursor);
+      this.url = `docs/window/?q=${this.searchQuery}&is_checked=${state}&count=true&cursor=${cursor}`;
       await this.search();
       this.pageNumber = 0;
     },
@@ -132,23 +156,12 @@ const annotationMixin = {
       this.submit();
     },
 
-    annotations() {
-      // fetch progress info.
-      HTTP.get('progress').then((response) => {
-        this.total = response.data.total;
-        this.remaining = response.data.remaining;
-      });
-    },
-
-    offset() {
-      storeOffsetInUrl(this.offset);
+    cursor() {
+      storeCursorInUrl(this.cursor);
     },
   },
 
   created() {
-    HTTP.get('labels').then((response) => {
-      this.labels = response.data;
-    });
     HTTP.get().then((response) => {
       this.guideline = response.data.guideline;
     });
@@ -156,6 +169,15 @@ const annotationMixin = {
   },
 
   computed: {
+    completedOnPage() {
+      // machine suggestions complete nothing until they are confirmed
+      return this.annotations.filter(annotations => annotations.some(a => a.manual !== false)).length;
+    },
+
+    remaining() {
+      return this.remainingAtLoad - (this.completedOnPage - this.completedAtLoad);
+    },
+
     achievement() {
       const done = this.total - this.remaining;
       const percentage = Math.round(done / this.total * 100);
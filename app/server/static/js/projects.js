@@ -15,6 +15,7 @@ const vm = new Vue({
     isDelete: false,
     project: null,
     selected: 'All Project',
+    progress: {},
   },
 
   methods: {
@@ -57,6 +58,14 @@ const vm = new Vue({
 
       return daysDiff;
     },
+
+    getAchievement(project) {
+      const progress = this.progress[project.id];
+      if (!progress || progress.total === 0) {
+        return 0;
+      }
+      return Math.floor(((progress.total - progress.remaining) / progress.total) * 100);
+    },
   },
 
   computed: {
@@ -75,5 +84,8 @@ const vm = new Vue({
     axios.get(`${baseUrl}/api/projects`).then((response) => {
       this.items = response.data;
     });
+    axios.get(`${baseUrl}/api/projects/progress/`).then((response) => {
+      this.progress = response.data;
+    });
   },
 });
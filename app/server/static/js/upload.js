@@ -1,4 +1,22 @@
 import Vue from 'vue';
+import axios from 'axios';
+
+axios.defaults.xsrfCookieName = 'csrftoken';
+axios.defaults.xsrfHeaderName = 'X-CSRFToken';
+axios.defaults.headers.common['X-Requested-With'] = 'XMLHttpRequest';
+const projectUrl = window.location.href.split('/').slice(3, 5).join('/');
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const PARALLEL_CHUNKS = 3;
+const MAX_RETRIES = 5;
+
+const sha256 = async function(blob) {
+  if (!window.crypto || !window.crypto.subtle) {
+    return '';
+  }
+  const buffer = await new Response(blob).arrayBuffer();
+  const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
 
 
 const vm = new Vue({
@@ -6,6 +24,9 @@ const vm = new Vue({
   delimiters: ['[[', ']]'],
   data: {
     file: '',
+    job: null,
+    isUploading: false,
+    error: '',
   },
 
   methods: {
@@ -13,5 +34,69 @@ const vm = new Vue({
       console.log(this.$refs.file.files);
       this.file = this.$refs.file.files[0].name;
     },
+
+    upload() {
+      const file = this.$refs.file.files[0];
+      this.isUploading = true;
+      this.error = '';
+      const request = file.size > CHUNK_SIZE
+        ? this.uploadInChunks(file)
+        : axios.post(window.location.href, new FormData(this.$refs.form));
+      request.then((response) => {
+        this.pollJob(response.data.url);
+      }).catch(this.showError);
+    },
+
+    showError(error) {
+      const data = error.response && error.response.data;
+      this.error = (data && data.detail) || error.message;
+      this.isUploading = false;
+    },
+
+    async uploadInChunks(file) {
+      const uploadsUrl = `/api/${projectUrl}/uploads/`;
+      const response = await axios.post(uploadsUrl, {
+        file_name: file.name,
+        total_size: file.size,
+        chunk_size: CHUNK_SIZE,
+        duplicates: this.$refs.form.elements.duplicates.value,
+      });
+      const upload = response.data;
+      const pending = Array.from(Array(upload.total_chunks).keys());
+
+      const putChunk = async (index, retries = 0) => {
+        const chunk = file.slice(index * upload.chunk_size, (index + 1) * upload.chunk_size);
+        const headers = { 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': await sha256(chunk) };
+        try {
+          await axios.put(`${uploadsUrl}${upload.id}/chunks/${index}`, chunk, { headers });
+        } catch (error) {
+          if (retries >= MAX_RETRIES) {
+            throw error;
+          }
+          await putChunk(index, retries + 1);
+        }
+      };
+      const worker = async () => {
+        while (pending.length) {
+          await putChunk(pending.shift());
+        }
+      };
+      await Promise.all(Array.from(Array(PARALLEL_CHUNKS), worker));
+
+      return axios.post(`${uploadsUrl}${upload.id}/finalize/`);
+    },
+
+    pollJob(url) {
+      axios.get(url).then((response) => {
+        this.job = response.data;
+        if (this.job.status === 'done') {
+          window.location.href = this.$refs.form.dataset.datasetUrl;
+        } else if (this.job.status === 'failed') {
+          this.isUploading = false;
+        } else {
+          setTimeout(() => this.pollJob(url), 1000);
+        }
+      }).catch(this.showError);
+    },
   },
 });
@@ -2,7 +2,7 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from mixer.backend.django import mixer
-from ..models import User, Project
+from ..models import User, Project, AnnotationCounter, DocumentCompletion, SequenceAnnotation
 
 
 class TestAnnotationAPI(APITestCase):
@@ -71,3 +71,163 @@ class TestAnnotationAPI(APITestCase):
         url = reverse('ann', args=[self.project1.id, self.doc1.id, self.annotation2.id])
         r = self.client.delete(url, format='json')
         self.assertEqual(r.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestAnnotationBulkAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username = 'user'
+        cls.password = 'pass'
+        cls.user = User.objects.create_user(username=cls.username, password=cls.password)
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.other_project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.doc = mixer.blend('server.Document', project=cls.project)
+        cls.label = mixer.blend('server.Label', project=cls.project)
+        cls.other_label = mixer.blend('server.Label', project=cls.other_project)
+        cls.url = reverse('annotations', args=[cls.project.id, cls.doc.id])
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+        self.annotation = SequenceAnnotation.objects.create(document=self.doc, user=self.user, label=self.label,
+                                                            start_offset=0, end_offset=1)
+
+    def get_spans(self, count, label=None):
+        return [{'label': (label or self.label).id, 'start_offset': i, 'end_offset': i + 1}
+                for i in range(1, count + 1)]
+
+    def test_creates_and_deletes_annotations(self):
+        """
+        Ensure annotations are created and deleted in one request, counters included.
+        """
+        r = self.client.patch(self.url, {'create': self.get_spans(2), 'delete': [self.annotation.id]}, format='json')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual([a['start_offset'] for a in r.data], [1, 2])
+        self.assertEqual(AnnotationCounter.objects.get(project=self.project, label=self.label).count, 2)
+        self.assertEqual(DocumentCompletion.objects.get(document=self.doc, user=self.user).annotations, 2)
+
+        r = self.client.patch(self.url, {'delete': [a['id'] for a in r.data]}, format='json')
+        self.assertEqual(r.data, [])
+        self.assertFalse(DocumentCompletion.objects.filter(document=self.doc).exists())
+
+    def test_queries_do_not_grow_with_annotations(self):
+        """
+        Ensure labels are validated and annotations written with a fixed number of queries.
+        """
+        self.client.get(self.url, format='json')
+        with self.assertNumQueries(15):
+            self.client.patch(self.url, {'create': self.get_spans(1)}, format='json')
+        with self.assertNumQueries(15):
+            self.client.patch(self.url, {'create': self.get_spans(40)[1:]}, format='json')
+        self.assertEqual(self.doc.seq_annotations.count(), 41)
+        ids = list(self.doc.seq_annotations.values_list('id', flat=True))
+        with self.assertNumQueries(21):
+            self.client.patch(self.url, {'delete': ids}, format='json')
+        self.assertEqual(self.doc.seq_annotations.count(), 0)
+
+    def test_rejects_other_projects_label(self):
+        """
+        Ensure nothing is written when an annotation is invalid.
+        """
+        spans = self.get_spans(1) + self.get_spans(1, self.other_label)
+        r = self.client.patch(self.url, {'create': spans, 'delete': [self.annotation.id]}, format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(self.doc.seq_annotations.all()), [self.annotation])
+
+    def test_rejects_duplicates(self):
+        """
+        Ensure duplicate annotations roll back the whole request.
+        """
+        spans = self.get_spans(1) * 2
+        r = self.client.patch(self.url, {'create': spans, 'delete': [self.annotation.id]}, format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(self.doc.seq_annotations.all()), [self.annotation])
+        self.assertEqual(AnnotationCounter.objects.get(project=self.project, label=self.label).count, 1)
+
+
+class TestAnnotationReplaceAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username = 'user'
+        cls.password = 'pass'
+        cls.user = User.objects.create_user(username=cls.username, password=cls.password)
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.doc = mixer.blend('server.Document', project=cls.project)
+        cls.label = mixer.blend('server.Label', project=cls.project)
+        cls.url = reverse('annotations', args=[cls.project.id, cls.doc.id])
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+        self.kept, self.removed = [SequenceAnnotation.objects.create(document=self.doc, user=self.user,
+                                                                     label=self.label, start_offset=i, end_offset=i + 1)
+                                   for i in range(2)]
+
+    def get_span(self, start_offset):
+        return {'label': self.label.id, 'start_offset': start_offset, 'end_offset': start_offset + 1}
+
+    def test_writes_only_the_difference(self):
+        """
+        Ensure stored annotations are kept, and only missing and extra ones are written.
+        """
+        r = self.client.put(self.url, [self.get_span(0), self.get_span(5)], format='json')
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual([(a['id'], a['start_offset']) for a in r.data][0], (self.kept.id, 0))
+        self.assertEqual([a['start_offset'] for a in r.data], [0, 5])
+        self.assertEqual(AnnotationCounter.objects.get(project=self.project, label=self.label).count, 2)
+
+        r = self.client.put(self.url, [], format='json')
+        self.assertEqual(r.data, [])
+        self.assertFalse(DocumentCompletion.objects.filter(document=self.doc).exists())
+
+    def test_rejects_stale_version(self):
+        """
+        Ensure annotations changed since they were read are not overwritten.
+        """
+        etag = self.client.get(self.url, format='json')['ETag']
+        r = self.client.put(self.url, [self.get_span(0)], format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(r['ETag'], etag)
+
+        r = self.client.put(self.url, [self.get_span(3)], format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(r.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(list(self.doc.seq_annotations.all()), [self.kept])
+
+    def test_rejects_invalid_annotations(self):
+        """
+        Ensure nothing is written when an annotation is invalid.
+        """
+        r = self.client.put(self.url, [self.get_span(0), {'label': 0, 'start_offset': 1}], format='json')
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.doc.seq_annotations.count(), 2)
+
+    def test_kept_suggestions_become_manual(self):
+        """
+        Ensure confirming a machine suggestion completes the document.
+        """
+        for annotation in SequenceAnnotation.objects.all():
+            annotation.delete()
+        suggestion = SequenceAnnotation.objects.create(document=self.doc, user=self.user, label=self.label,
+                                                       start_offset=0, end_offset=1, manual=False)
+        self.assertFalse(DocumentCompletion.objects.filter(document=self.doc).exists())
+
+        r = self.client.put(self.url, [self.get_span(0)], format='json')
+        self.assertEqual(r.data[0]['id'], suggestion.id)
+        self.assertTrue(SequenceAnnotation.objects.get(id=suggestion.id).manual)
+        self.assertEqual(DocumentCompletion.objects.get(document=self.doc, user=self.user).annotations, 1)
+
+    def test_posting_a_suggestion_confirms_it(self):
+        """
+        Ensure posting the span of a machine suggestion confirms it instead of adding another.
+        """
+        for annotation in SequenceAnnotation.objects.all():
+            annotation.delete()
+        suggestion = SequenceAnnotation.objects.create(document=self.doc, user=self.user, label=self.label,
+                                                       start_offset=0, end_offset=1, manual=False)
+
+        r = self.client.post(self.url, self.get_span(0), format='json')
+        self.assertEqual(r.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((r.data['id'], r.data['manual']), (suggestion.id, True))
+        self.assertEqual(self.doc.seq_annotations.count(), 1)
+        self.assertEqual(DocumentCompletion.objects.get(document=self.doc, user=self.user).annotations, 1)
+        self.assertEqual(AnnotationCounter.objects.get(project=self.project, label=self.label).count, 1)
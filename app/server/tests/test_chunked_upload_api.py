@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from mixer.backend.django import mixer
+from ..importers import expire_chunked_uploads, get_chunk_dir, run_import_job
+from ..models import User, Project, ImportJob, ChunkedUpload
+
+
+@override_settings(IMPORT_STAGING_DIR=tempfile.mkdtemp())
+class TestChunkedUploadAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username = 'super'
+        cls.password = 'pass'
+        cls.super_user = User.objects.create_superuser(username=cls.username, password=cls.password,
+                                                       email='fizz@buzz.com')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING,
+                                  users=[cls.super_user])
+        cls.content = ''.join('{{"text": "document {}"}}\n'.format(i) for i in range(10)).encode('utf-8')
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+
+    def init_upload(self, **kwargs):
+        data = {'file_name': 'dataset.jsonl', 'total_size': len(self.content), 'chunk_size': 64,
+                'checksum': hashlib.sha256(self.content).hexdigest()}
+        data.update(kwargs)
+        url = reverse('chunked-uploads', args=[self.project.id])
+
+        return self.client.post(url, data, format='json')
+
+    def put_chunk(self, upload_id, index, chunk_size=64, checksum=None):
+        chunk = self.content[index * chunk_size:(index + 1) * chunk_size]
+        if checksum is None:
+            checksum = hashlib.sha256(chunk).hexdigest()
+        url = reverse('chunked-upload-chunk', args=[self.project.id, upload_id, index])
+
+        return self.client.put(url, chunk, content_type='application/octet-stream', HTTP_X_CHUNK_SHA256=checksum)
+
+    def finalize(self, upload_id):
+        url = reverse('chunked-upload-finalize', args=[self.project.id, upload_id])
+
+        return self.client.post(url, format='json')
+
+    def test_upload_in_chunks(self):
+        """
+        Ensure chunks sent in any order, with retries, are assembled and imported.
+        """
+        response = self.init_upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data['id']
+        total_chunks = response.data['total_chunks']
+        self.assertGreater(total_chunks, 1)
+
+        for index in reversed(range(total_chunks)):
+            self.assertEqual(self.put_chunk(upload_id, index).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.put_chunk(upload_id, 0).status_code, status.HTTP_200_OK)
+
+        url = reverse('chunked-upload', args=[self.project.id, upload_id])
+        self.assertEqual(self.client.get(url).data['received_chunks'], list(range(total_chunks)))
+
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = run_import_job(ImportJob.objects.get(pk=response.data['id']))
+        self.assertEqual(job.rows_inserted, 10)
+        self.assertEqual(self.project.documents.count(), 10)
+
+        # Finalizing again returns the same job.
+        self.assertEqual(self.finalize(upload_id).data['id'], job.id)
+
+    def test_reject_corrupted_chunk(self):
+        upload_id = self.init_upload().data['id']
+        response = self.put_chunk(upload_id, 0, checksum='0' * 64)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        url = reverse('chunked-upload', args=[self.project.id, upload_id])
+        self.assertEqual(self.client.get(url).data['received_chunks'], [])
+
+    def test_reject_out_of_range_chunk(self):
+        upload_id = self.init_upload().data['id']
+        url = reverse('chunked-upload-chunk', args=[self.project.id, upload_id, 100])
+        response = self.client.put(url, b'x', content_type='application/octet-stream')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_with_missing_chunks(self):
+        upload_id = self.init_upload().data['id']
+        self.put_chunk(upload_id, 0)
+
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ImportJob.objects.count(), 0)
+
+    def test_finalize_with_wrong_checksum(self):
+        upload_id = self.init_upload(checksum='0' * 64).data['id']
+        for index in range(-(-len(self.content) // 64)):
+            self.put_chunk(upload_id, index)
+
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expire_abandoned_upload(self):
+        """
+        Ensure an upload that receives no chunks for a while is removed with its chunks.
+        """
+        upload_id = self.init_upload().data['id']
+        self.put_chunk(upload_id, 0)
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        chunk_dir = get_chunk_dir(upload)
+
+        self.assertEqual(expire_chunked_uploads(), 0)
+        with override_settings(IMPORT_UPLOAD_EXPIRY_SECONDS=0):
+            self.assertEqual(expire_chunked_uploads(), 1)
+        self.assertFalse(ChunkedUpload.objects.filter(pk=upload_id).exists())
+        self.assertFalse(os.path.exists(chunk_dir))
+
+    def test_reject_unsupported_format(self):
+        response = self.init_upload(file_name='dataset.exe')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
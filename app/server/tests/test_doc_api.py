@@ -1,8 +1,11 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from mixer.backend.django import mixer
-from ..models import User
+from ..models import User, Document
 
 
 class TestDocAPI(APITestCase):
@@ -63,3 +66,260 @@ class TestDocAPI(APITestCase):
         response = self.client.get(url, format='json')
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_filter_checked_docs(self):
+        """
+        Ensure is_checked filters documents by whether they are annotated.
+        """
+        user = self.create_user()
+        project = mixer.blend('server.Project', project_type='DocumentClassification', users=[user])
+        checked = mixer.blend('server.Document', project=project)
+        unchecked = mixer.blend('server.Document', project=project)
+        mixer.blend('server.DocumentAnnotation', document=checked, user=user,
+                    label=mixer.blend('server.Label', project=project))
+        url = reverse('docs', args=[project.id])
+
+        self.client.login(username=self.username, password=self.password)
+        active = self.client.get(url, {'is_checked': 'true'}, format='json')
+        completed = self.client.get(url, {'is_checked': 'false'}, format='json')
+
+        self.assertEqual([doc['id'] for doc in active.data['results']], [unchecked.id])
+        self.assertEqual([doc['id'] for doc in completed.data['results']], [checked.id])
+
+
+class TestDocCursorPagination(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username, cls.password = 'user', 'pass'
+        cls.user = User.objects.create_user(username=cls.username, password=cls.password)
+        cls.project = mixer.blend('server.Project', project_type='DocumentClassification', users=[cls.user])
+        cls.label = mixer.blend('server.Label', project=cls.project)
+        cls.docs = [mixer.blend('server.Document', project=cls.project, text='{} {}'.format(word, i))
+                    for i in range(6) for word in ('apple', 'banana')]
+        for doc in cls.docs[:4]:
+            mixer.blend('server.DocumentAnnotation', document=doc, user=cls.user, label=cls.label)
+        cls.url = reverse('docs', args=[cls.project.id])
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username=self.username, password=self.password)
+
+    def get_all_pages(self, params):
+        ids, response = [], self.client.get(self.url, dict(params, cursor=''), format='json')
+        while True:
+            ids.extend(doc['id'] for doc in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'], format='json')
+
+    def test_pages_follow_document_id(self):
+        """
+        Ensure cursor pages list every document once, in id order.
+        """
+        ids = self.get_all_pages({'limit': 5})
+        self.assertEqual(ids, [doc.id for doc in self.docs])
+
+    def test_pages_with_filters(self):
+        """
+        Ensure cursor pages can be combined with the is_checked and q filters.
+        """
+        ids = self.get_all_pages({'limit': 2, 'q': 'apple', 'is_checked': 'true'})
+        self.assertEqual(ids, [doc.id for doc in self.docs[4:] if doc.text.startswith('apple')])
+
+    def test_page_query_is_keyed_on_id(self):
+        """
+        Ensure deep pages seek on the id instead of skipping rows.
+        """
+        response = self.client.get(self.url, {'cursor': '', 'limit': 5}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'], format='json')
+
+        sql = [query['sql'] for query in queries if 'FROM "server_document"' in query['sql']]
+        self.assertEqual(len(sql), 1)
+        self.assertIn('"server_document"."id" >', sql[0])
+        self.assertNotIn('OFFSET', sql[0])
+
+    def test_count_is_optional_and_cached(self):
+        """
+        Ensure the count is only computed when asked for, and is reused.
+        """
+        response = self.client.get(self.url, {'cursor': ''}, format='json')
+        self.assertIsNone(response.data['count'])
+
+        response = self.client.get(self.url, {'cursor': '', 'count': 'true'}, format='json')
+        self.assertEqual(response.data['count'], len(self.docs))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'cursor': '', 'count': 'true'}, format='json')
+        self.assertEqual(response.data['count'], len(self.docs))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+
+class TestDocListQueries(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username, cls.password = 'user', 'pass'
+        cls.user = User.objects.create_user(username=cls.username, password=cls.password)
+        other = mixer.blend('auth.User')
+        cls.project = mixer.blend('server.Project', project_type='SequenceLabeling', users=[cls.user])
+        cls.label = mixer.blend('server.Label', project=cls.project)
+        for i in range(10):
+            doc = mixer.blend('server.Document', project=cls.project)
+            for user in (cls.user, other):
+                mixer.blend('server.SequenceAnnotation', document=doc, user=user, label=cls.label,
+                            start_offset=0, end_offset=1)
+        cls.url = reverse('docs', args=[cls.project.id])
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+
+    def test_annotations_are_prefetched(self):
+        """
+        Ensure a page of documents takes the same queries whatever its size.
+        """
+        self.client.get(self.url, format='json')
+        for limit in (1, 10):
+            with self.assertNumQueries(7):
+                response = self.client.get(self.url, {'limit': limit}, format='json')
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_only_own_annotations_are_listed(self):
+        """
+        Ensure the prefetched annotations are the requesting user's.
+        """
+        response = self.client.get(self.url, {'limit': 10}, format='json')
+        for doc in response.data['results']:
+            self.assertEqual(len(doc['annotations']), 1)
+
+
+class TestDocSearch(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username, cls.password = 'user', 'pass'
+        cls.user = User.objects.create_user(username=cls.username, password=cls.password)
+        cls.project = mixer.blend('server.Project', project_type='DocumentClassification', users=[cls.user])
+        cls.long = mixer.blend('server.Document', project=cls.project,
+                               text='a long text that mentions pineapples once among many other words')
+        cls.short = mixer.blend('server.Document', project=cls.project, text='Pineapple')
+        cls.other = mixer.blend('server.Document', project=cls.project, text='banana')
+        cls.url = reverse('docs', args=[cls.project.id])
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, dict(params, q=q), format='json')
+        return [doc['id'] for doc in response.data['results']]
+
+    def test_substrings_are_ranked(self):
+        """
+        Ensure search matches inside words and lists the best matches first.
+        """
+        self.assertEqual(self.search('apple'), [self.short.id, self.long.id])
+        self.assertEqual(self.search('pineapple text'), [self.long.id])
+        self.assertEqual(self.search('apple', cursor=''), [self.short.id, self.long.id])
+
+    def test_short_terms_fall_back_to_like(self):
+        """
+        Ensure terms too short for the index are still searched.
+        """
+        self.assertEqual(self.search('na'), [self.other.id])
+
+    def test_index_follows_document_changes(self):
+        """
+        Ensure updated, deleted and bulk created documents are found accordingly.
+        """
+        Document.objects.filter(id=self.other.id).update(text='cherry')
+        Document.objects.filter(id=self.short.id).delete()
+        Document.objects.bulk_create([Document(project=self.project, text='apple pie')])
+
+        self.assertEqual(self.search('banana'), [])
+        self.assertEqual(self.search('cherry'), [self.other.id])
+        self.assertEqual(len(self.search('apple')), 2)
+
+
+class TestDocQueue(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project_member_name, cls.project_member_pass = 'project_member_name', 'project_member_pass'
+        cls.other_member_name, cls.other_member_pass = 'other_member_name', 'other_member_pass'
+        cls.non_member_name, cls.non_member_pass = 'non_member_name', 'non_member_pass'
+        project_member = User.objects.create_user(username=cls.project_member_name, password=cls.project_member_pass)
+        other_member = User.objects.create_user(username=cls.other_member_name, password=cls.other_member_pass)
+        User.objects.create_user(username=cls.non_member_name, password=cls.non_member_pass)
+        cls.project = mixer.blend('server.Project', project_type='SequenceLabeling',
+                                  users=[project_member, other_member])
+        cls.docs = mixer.cycle(3).blend('server.Document', project=cls.project)
+        cls.url = reverse('next-docs', args=[cls.project.id])
+
+    def test_members_get_different_documents(self):
+        self.client.login(username=self.project_member_name, password=self.project_member_pass)
+        response = self.client.post(self.url + '?limit=2', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([doc['id'] for doc in response.data['results']], [self.docs[0].id, self.docs[1].id])
+        self.assertEqual(response.data['results'][0]['annotations'], [])
+
+        self.client.login(username=self.other_member_name, password=self.other_member_pass)
+        response = self.client.post(self.url, format='json')
+        self.assertEqual([doc['id'] for doc in response.data['results']], [self.docs[2].id])
+
+    def test_disallows_non_project_member(self):
+        self.client.login(username=self.non_member_name, password=self.non_member_pass)
+        response = self.client.post(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestDocWindow(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project_member_name, cls.project_member_pass = 'project_member_name', 'project_member_pass'
+        cls.non_member_name, cls.non_member_pass = 'non_member_name', 'non_member_pass'
+        cls.project_member = User.objects.create_user(username=cls.project_member_name,
+                                                      password=cls.project_member_pass)
+        User.objects.create_user(username=cls.non_member_name, password=cls.non_member_pass)
+        cls.project = mixer.blend('server.Project', project_type='DocumentClassification',
+                                  users=[cls.project_member])
+        cls.label = mixer.blend('server.Label', project=cls.project)
+        cls.docs = mixer.cycle(3).blend('server.Document', project=cls.project)
+        cls.url = reverse('doc-window', args=[cls.project.id])
+
+    def setUp(self):
+        self.client.login(username=self.project_member_name, password=self.project_member_pass)
+
+    def test_returns_documents_with_labels_and_progress(self):
+        mixer.blend('server.DocumentAnnotation', document=self.docs[0], user=self.project_member, label=self.label)
+        response = self.client.get(self.url, {'limit': 2, 'cursor': ''}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([doc['id'] for doc in response.data['results']], [self.docs[0].id, self.docs[1].id])
+        self.assertEqual(len(response.data['results'][0]['annotations']), 1)
+        self.assertEqual([label['id'] for label in response.data['labels']], [self.label.id])
+        self.assertEqual(response.data['progress'], {'total': 3, 'remaining': 2})
+        self.assertIsNotNone(response.data['next'])
+
+    def test_unchanged_window_is_not_modified(self):
+        etag = self.client.get(self.url, format='json')['ETag']
+        with self.assertNumQueries(7):
+            response = self.client.get(self.url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        mixer.blend('server.DocumentAnnotation', document=self.docs[0], user=self.project_member, label=self.label)
+        response = self.client.get(self.url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_label_change_modifies_window(self):
+        etag = self.client.get(self.url, format='json')['ETag']
+        mixer.blend('server.Label', project=self.project)
+
+        response = self.client.get(self.url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['labels']), 2)
+
+    def test_disallows_non_project_member(self):
+        self.client.login(username=self.non_member_name, password=self.non_member_pass)
+        response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,298 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+import openpyxl
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from mixer.backend.django import mixer
+from ..exporters import FULL_WRITERS, iter_json_lines, iter_csv_lines, write_excel, write_parquet, get_snapshot, \
+    open_snapshot, refresh_stale_snapshots
+from ..models import User, Project, Label, ExportSnapshot, SequenceAnnotation
+
+
+class SnapshotDirMixin(object):
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(EXPORT_SNAPSHOT_DIR=self.snapshot_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.snapshot_dir)
+
+
+class TestJsonExport(SnapshotDirMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='super', password='pass', email='fizz@buzz.com')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.label = mixer.blend('server.Label', project=cls.project, text='PERSON')
+        cls.docs = [mixer.blend('server.Document', project=cls.project, text='Alice {}'.format(i), metadata='{}')
+                    for i in range(5)]
+        for doc in cls.docs:
+            mixer.blend('server.SequenceAnnotation', document=doc, user=cls.user, label=cls.label,
+                        start_offset=0, end_offset=5)
+
+    @override_settings(EXPORT_BATCH_SIZE=2)
+    def test_queries_per_chunk(self):
+        docs = Project.objects.get(pk=self.project.pk).documents.all()
+
+        # One query for the documents and one per chunk of two documents.
+        with self.assertNumQueries(4):
+            lines = list(iter_json_lines(self.project, docs))
+
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0]), {'text': 'Alice 0', 'labels': [[0, 5, 'PERSON']], 'metadata': {}})
+
+    def test_download_json(self):
+        self.client.login(username='super', password='pass')
+        url = reverse('download_file', args=[self.project.id])
+        response = self.client.get(url, {'format': 'json'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['text'] for line in lines], [doc.text for doc in self.docs])
+
+
+class TestTableExport(SnapshotDirMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='super', password='pass', email='fizz@buzz.com')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.label = mixer.blend('server.Label', project=cls.project, text='PERSON')
+        cls.docs = [mixer.blend('server.Document', project=cls.project, text='Alice {}'.format(i), metadata='{}')
+                    for i in range(3)]
+        for doc in cls.docs:
+            mixer.blend('server.SequenceAnnotation', document=doc, user=cls.user, label=cls.label,
+                        start_offset=0, end_offset=5)
+
+    def test_csv_rows(self):
+        lines = list(iter_csv_lines(self.project, self.project.documents.all()))
+        rows = list(csv.reader(io.StringIO(''.join(lines))))
+
+        self.assertEqual(rows[0], ['text', 'labels', 'metadata'])
+        self.assertEqual(rows[1], ['Alice 0', "[[0, 5, 'PERSON']]", '{}'])
+        self.assertEqual(len(rows), 4)
+
+    def test_classification_csv_has_a_row_per_annotation(self):
+        project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION)
+        label = mixer.blend('server.Label', project=project, text='positive')
+        doc = mixer.blend('server.Document', project=project, text='good', metadata='{}')
+        mixer.blend('server.DocumentAnnotation', document=doc, user=self.user, label=label)
+        mixer.blend('server.DocumentAnnotation', document=doc, user=mixer.blend('auth.User'), label=label)
+        lines = list(iter_csv_lines(project, project.documents.all()))
+
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(next(csv.reader(lines[1:2])), [str(doc.id), 'good', 'positive', 'super', '{}'])
+
+    def test_excel_rows(self):
+        with write_excel(self.project, self.project.documents.all()) as file:
+            worksheet = openpyxl.load_workbook(file, read_only=True).active
+            rows = [list(row) for row in worksheet.iter_rows(values_only=True)]
+
+        self.assertEqual(rows[0], ['text', 'labels', 'metadata'])
+        self.assertEqual(rows[1:], [[doc.text, "[[0, 5, 'PERSON']]", '{}'] for doc in self.docs])
+
+    def test_download_csv(self):
+        self.client.login(username='super', password='pass')
+        url = reverse('download_file', args=[self.project.id])
+        response = self.client.get(url, {'format': 'csv'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8').splitlines()), 4)
+
+    def test_download_excel(self):
+        self.client.login(username='super', password='pass')
+        url = reverse('download_file', args=[self.project.id])
+        response = self.client.get(url, {'format': 'excel'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(int(response['Content-Length']) > 0)
+        worksheet = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True).active
+        self.assertEqual(len(list(worksheet.iter_rows())), 4)
+
+
+class TestParquetExport(SnapshotDirMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='super', password='pass', email='fizz@buzz.com')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.label = mixer.blend('server.Label', project=cls.project, text='PERSON')
+        cls.docs = [mixer.blend('server.Document', project=cls.project, text='Alice {}'.format(i),
+                                metadata='{"i": %d}' % i)
+                    for i in range(5)]
+        for doc in cls.docs:
+            mixer.blend('server.SequenceAnnotation', document=doc, user=cls.user, label=cls.label,
+                        start_offset=0, end_offset=5)
+
+    @override_settings(EXPORT_BATCH_SIZE=2)
+    def test_row_groups_and_nested_spans(self):
+        with write_parquet(self.project, self.project.documents.all()) as file:
+            parquet_file = pq.ParquetFile(file)
+            self.assertEqual(parquet_file.num_row_groups, 3)
+            table = parquet_file.read()
+
+        rows = table.to_pydict()
+        self.assertEqual(rows['doc_id'], [doc.id for doc in self.docs])
+        self.assertEqual(rows['metadata'][1], '{"i": 1}')
+        self.assertEqual(rows['annotations'][0],
+                         [{'user': 'super', 'label': 'PERSON', 'start_offset': 0, 'end_offset': 5}])
+
+    def test_classification_columns(self):
+        project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION)
+        label = mixer.blend('server.Label', project=project, text='positive')
+        doc = mixer.blend('server.Document', project=project, text='good', metadata='{}')
+        mixer.blend('server.DocumentAnnotation', document=doc, user=self.user, label=label)
+
+        with write_parquet(project, project.documents.all()) as file:
+            table = pq.read_table(file, columns=['annotations'])
+
+        self.assertEqual(table.to_pydict(), {'annotations': [[{'user': 'super', 'label': 'positive'}]]})
+
+    def test_download_parquet(self):
+        self.client.login(username='super', password='pass')
+        url = reverse('download_file', args=[self.project.id])
+        response = self.client.get(url, {'format': 'parquet_all'})
+
+        self.assertEqual(response.status_code, 200)
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 5)
+
+
+class TestExportSnapshot(SnapshotDirMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='super', password='pass', email='fizz@buzz.com')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING, users=[cls.user])
+        cls.label = mixer.blend('server.Label', project=cls.project, text='PERSON')
+        cls.docs = [mixer.blend('server.Document', project=cls.project, text='Alice {}'.format(i), metadata='{}')
+                    for i in range(6)]
+        for doc in cls.docs:
+            mixer.blend('server.SequenceAnnotation', document=doc, user=cls.user, label=cls.label,
+                        start_offset=0, end_offset=5)
+
+    def read(self, snapshot):
+        with open(snapshot.file_path, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def expected_json(self):
+        return ''.join(iter_json_lines(self.project, self.project.get_documents(is_null=False).distinct()))
+
+    def test_snapshot_is_reused_until_stale(self):
+        snapshot = get_snapshot(self.project, ExportSnapshot.JSON)
+
+        self.assertFalse(snapshot.is_stale)
+        self.assertEqual(snapshot.documents_rewritten, 6)
+        self.assertEqual(self.read(snapshot), self.expected_json())
+        self.assertEqual(get_snapshot(self.project, ExportSnapshot.JSON).file_path, snapshot.file_path)
+
+    def test_refresh_rewrites_changed_documents_only(self):
+        snapshot = get_snapshot(self.project, ExportSnapshot.JSON)
+        SequenceAnnotation.objects.create(document=self.docs[2], user=self.user, label=self.label,
+                                          start_offset=6, end_offset=7)
+        self.docs[4].delete()
+        self.assertTrue(ExportSnapshot.objects.get(pk=snapshot.pk).is_stale)
+
+        refreshed = get_snapshot(self.project, ExportSnapshot.JSON)
+
+        self.assertNotEqual(refreshed.file_path, snapshot.file_path)
+        self.assertEqual(refreshed.documents_rewritten, 1)
+        self.assertEqual(self.read(refreshed), self.expected_json())
+
+    def test_refresh_csv_snapshot(self):
+        get_snapshot(self.project, ExportSnapshot.CSV, labeled_only=False)
+        mixer.blend('server.Document', project=self.project, text='Bob', metadata='{}')
+        self.docs[0].seq_annotations.get().delete()
+
+        snapshot = get_snapshot(self.project, ExportSnapshot.CSV, labeled_only=False)
+
+        self.assertEqual(snapshot.documents_rewritten, 2)
+        self.assertEqual(self.read(snapshot), ''.join(iter_csv_lines(self.project, self.project.documents.all())))
+
+    def test_label_change_rewrites_all_documents(self):
+        get_snapshot(self.project, ExportSnapshot.JSON)
+        self.label.text = 'PER'
+        self.label.save()
+
+        snapshot, = refresh_stale_snapshots(delay=0)
+
+        self.assertEqual(snapshot.documents_rewritten, 6)
+        self.assertIn('"PER"', self.read(snapshot))
+
+    def test_label_color_change_keeps_snapshot(self):
+        get_snapshot(self.project, ExportSnapshot.JSON)
+        label = Label.objects.get(pk=self.label.pk)
+        label.background_color = '#000000'
+        label.save()
+
+        self.assertEqual(refresh_stale_snapshots(delay=0), [])
+
+    def test_background_refresh_waits_for_changes_to_settle(self):
+        snapshot = get_snapshot(self.project, ExportSnapshot.JSON)
+        self.docs[0].seq_annotations.get().delete()
+
+        self.assertEqual(refresh_stale_snapshots(), [])
+        stale_since = timezone.now() - timedelta(seconds=settings.EXPORT_REFRESH_DELAY_SECONDS)
+        ExportSnapshot.objects.filter(pk=snapshot.pk).update(stale_since=stale_since)
+        self.assertEqual(len(refresh_stale_snapshots()), 1)
+
+    def test_failed_refresh_does_not_stop_the_others(self):
+        get_snapshot(self.project, ExportSnapshot.JSON)
+        get_snapshot(self.project, ExportSnapshot.EXCEL)
+        self.docs[0].seq_annotations.get().delete()
+
+        with mock.patch.dict(FULL_WRITERS, {ExportSnapshot.EXCEL: mock.Mock(side_effect=OSError('disk full'))}), \
+                self.assertLogs('server.exporters', 'ERROR'):
+            snapshot, = refresh_stale_snapshots(delay=0)
+        self.assertEqual(snapshot.export_format, ExportSnapshot.JSON)
+        self.assertTrue(ExportSnapshot.objects.get(export_format=ExportSnapshot.EXCEL).is_stale)
+
+    def test_open_snapshot_replaced_by_concurrent_refresh(self):
+        current = get_snapshot(self.project, ExportSnapshot.JSON)
+        replaced = ExportSnapshot(project=self.project, file_path=os.path.join(self.snapshot_dir, 'replaced.json'))
+
+        with mock.patch('server.exporters.get_snapshot', side_effect=[replaced, current]):
+            snapshot, file = open_snapshot(self.project, ExportSnapshot.JSON)
+        with file:
+            self.assertEqual(snapshot.file_path, current.file_path)
+            self.assertEqual(file.read().decode('utf-8'), self.expected_json())
+
+    def test_download_range(self):
+        self.client.login(username='super', password='pass')
+        url = reverse('download_file', args=[self.project.id])
+        body = self.expected_json().encode('utf-8')
+
+        response = self.client.get(url, {'format': 'json'}, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/{}'.format(len(body)))
+        self.assertEqual(b''.join(response.streaming_content), body[10:20])
+
+        response = self.client.get(url, {'format': 'json'}, HTTP_RANGE='bytes=-5', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(b''.join(response.streaming_content), body[-5:])
+
+        response = self.client.get(url, {'format': 'json'}, HTTP_RANGE='bytes={}-'.format(len(body)))
+        self.assertEqual(response.status_code, 416)
+
+    def test_download_whole_file(self):
+        self.client.login(username='super', password='pass')
+        url = reverse('download_file', args=[self.project.id])
+        response = self.client.get(url, {'format': 'json'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), len(self.expected_json().encode('utf-8')))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
@@ -0,0 +1,96 @@
+import os
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from mixer.backend.django import mixer
+from ..importers import claim_import_job, run_import_job
+from ..models import User, Project, ImportJob
+
+
+@override_settings(IMPORT_STAGING_DIR=tempfile.mkdtemp())
+class TestImportJobAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username = 'super'
+        cls.password = 'pass'
+        cls.super_user = User.objects.create_superuser(username=cls.username, password=cls.password,
+                                                       email='fizz@buzz.com')
+        cls.normal_user = User.objects.create_user(username='user', password=cls.password)
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING,
+                                  users=[cls.super_user, cls.normal_user])
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+
+    def create_job(self, content, file_format='jsonl'):
+        file_path = os.path.join(tempfile.mkdtemp(), 'upload.{}'.format(file_format))
+        with open(file_path, 'w') as f:
+            f.write(content)
+
+        return ImportJob.objects.create(project=self.project, user=self.super_user,
+                                        file_path=file_path, file_format=file_format)
+
+    def test_job_reports_progress(self):
+        """
+        Ensure a finished job reports its row counts.
+        """
+        job = self.create_job('{"text": "a"}\n{"text": "b"}\n')
+        run_import_job(claim_import_job())
+
+        url = reverse('import-job', args=[self.project.id, job.id])
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], ImportJob.DONE)
+        self.assertEqual(response.data['rows_parsed'], 2)
+        self.assertEqual(response.data['rows_inserted'], 2)
+        self.assertEqual(response.data['errors'], [])
+        self.assertFalse(os.path.exists(job.file_path))
+
+    def test_job_reports_errors(self):
+        """
+        Ensure a failed job reports why it failed.
+        """
+        job = self.create_job('{"text": "a"}\nnot json\n')
+        run_import_job(claim_import_job())
+
+        url = reverse('import-job', args=[self.project.id, job.id])
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.data['status'], ImportJob.FAILED)
+        self.assertEqual(len(response.data['errors']), 1)
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        self.create_job('{"text": "a"}\n')
+        self.assertIsNotNone(claim_import_job())
+        self.assertIsNone(claim_import_job())
+
+    def test_stale_job_is_resumed(self):
+        """
+        Ensure a job abandoned by a crashed worker is claimed again and skips the rows it inserted.
+        """
+        self.create_job('{"text": "a"}\n{"text": "b"}\n{"text": "c"}\n')
+        job = claim_import_job()
+        self.assertIsNone(claim_import_job())
+        mixer.blend('server.Document', project=self.project, text='a')
+        stale = timezone.now() - timedelta(seconds=settings.IMPORT_STALE_SECONDS + 1)
+        ImportJob.objects.filter(pk=job.pk).update(rows_parsed=1, rows_inserted=1, heartbeat_at=stale)
+
+        job = run_import_job(claim_import_job())
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_parsed, 3)
+        self.assertEqual(sorted(self.project.documents.values_list('text', flat=True)), ['a', 'b', 'c'])
+
+    def test_normal_user_cannot_get_job(self):
+        """
+        Ensure a non admin user cannot read import jobs.
+        """
+        job = self.create_job('{"text": "a"}\n')
+        self.client.login(username='user', password=self.password)
+        url = reverse('import-job', args=[self.project.id, job.id])
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,288 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+import openpyxl
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from mixer.backend.django import mixer
+from ..importers import DocumentImporter, LabelDecoder, ImportFileError, csv_to_dicts, xlsx_to_dicts, \
+    split_file, parse_jsonl_parallel, run_import_job, MAX_REPORTED_ERRORS
+from ..models import User, Project, Document, SequenceAnnotation, DocumentAnnotation, ImportJob, AnnotationCounter
+from ..utils import get_content_hash
+
+
+class TestDocumentImporter(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', password='pass')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING)
+        cls.person = mixer.blend('server.Label', project=cls.project, text='PERSON')
+        cls.loc = mixer.blend('server.Label', project=cls.project, text='LOC')
+
+    def test_import_entries_in_batches(self):
+        entries = [{'text': 'doc {}'.format(i), 'labels': [[0, 3, 'PERSON']]} for i in range(5)]
+        count = DocumentImporter(self.project, self.user, batch_size=2).import_entries(entries)
+
+        self.assertEqual(count, 5)
+        self.assertEqual(self.project.documents.count(), 5)
+        for doc in self.project.documents.all():
+            annotations = doc.seq_annotations.all()
+            self.assertEqual(len(annotations), 1)
+            self.assertEqual(annotations[0].label, self.person)
+            self.assertEqual(annotations[0].user, self.user)
+
+    def test_import_updates_counters(self):
+        entries = [{'text': 'Tokyo', 'labels': [[0, 5, 'LOC']]},
+                   {'text': 'Alice in Tokyo', 'labels': [[0, 5, 'PERSON'], [9, 14, 'LOC']]}]
+        DocumentImporter(self.project, self.user, batch_size=1).import_entries(entries)
+
+        counters = AnnotationCounter.objects.filter(project=self.project, user=self.user)
+        self.assertEqual(dict(counters.values_list('label', 'count')), {self.loc.id: 2, self.person.id: 1})
+
+    def test_annotations_map_to_their_own_document(self):
+        mixer.blend('server.Document', project=mixer.blend('server.Project'))
+        entries = [{'text': 'Tokyo', 'labels': [[0, 5, 'LOC']]},
+                   {'text': 'Alice', 'labels': [[0, 5, 'PERSON']]}]
+        DocumentImporter(self.project, self.user).import_entries(entries)
+
+        tokyo = Document.objects.get(text='Tokyo')
+        alice = Document.objects.get(text='Alice')
+        self.assertEqual(tokyo.seq_annotations.get().label, self.loc)
+        self.assertEqual(alice.seq_annotations.get().label, self.person)
+
+    def test_unknown_and_duplicate_labels_are_skipped(self):
+        entries = [{'text': 'Alice', 'labels': [[0, 5, 'PERSON'], [0, 5, 'PERSON'], [0, 5, 'ORG']]}]
+        importer = DocumentImporter(self.project, self.user)
+        importer.import_entries(entries)
+
+        self.assertEqual(SequenceAnnotation.objects.count(), 1)
+        self.assertEqual(importer.errors, ["Row 1: unknown label 'ORG'"])
+
+    def test_only_the_first_errors_are_kept(self):
+        entries = [{'text': 'Alice', 'labels': [[0, 5, 'ORG']]}] * (MAX_REPORTED_ERRORS + 10)
+        importer = DocumentImporter(self.project, self.user, batch_size=7)
+        importer.import_entries(entries)
+
+        self.assertEqual(len(importer.errors), MAX_REPORTED_ERRORS)
+        self.assertEqual(importer.error_count, MAX_REPORTED_ERRORS + 10)
+
+    def test_rows_without_text_are_reported(self):
+        entries = [{'text': 'Alice'}, {'labels': [[0, 5, 'PERSON']]}, ['Bob'],
+                   {'text': 'Tokyo', 'labels': [[9, 14, 'LOC']]}]
+        importer = DocumentImporter(self.project, self.user)
+
+        self.assertEqual(importer.import_entries(entries), 2)
+        self.assertEqual(importer.errors, ['Row 2: missing text', 'Row 3: expected an object, got list',
+                                           "Row 4: span [9, 14, 'LOC'] is out of the text range"])
+        self.assertEqual(importer.rows_seen, 4)
+
+    def test_metadata_keeps_extra_keys(self):
+        DocumentImporter(self.project, self.user).import_entries([{'text': 'Alice', 'external_id': 1}])
+
+        self.assertEqual(Document.objects.get().metadata, '{"external_id": 1}')
+
+    def test_texts_are_strings(self):
+        DocumentImporter(self.project, self.user).import_entries([{'text': 123}])
+
+        document = Document.objects.get()
+        self.assertEqual((document.text, document.content_hash), ('123', get_content_hash('123')))
+
+    def test_import_classification_labels(self):
+        project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION)
+        positive = mixer.blend('server.Label', project=project, text='positive')
+        DocumentImporter(project, self.user).import_entries([{'text': 'good', 'labels': ['positive']}])
+
+        self.assertEqual(DocumentAnnotation.objects.get().label, positive)
+
+
+class TestDuplicateImports(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', password='pass')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING)
+        cls.existing = mixer.blend('server.Document', project=cls.project, text='Alice', metadata='{}')
+
+    def import_entries(self, duplicates):
+        entries = [{'text': 'Alice', 'id': 1}, {'text': 'Bob', 'id': 2}, {'text': 'Bob', 'id': 3}]
+        importer = DocumentImporter(self.project, self.user, duplicates=duplicates)
+        importer.import_entries(entries)
+
+        return importer
+
+    def test_allow_duplicates(self):
+        importer = self.import_entries(ImportJob.ALLOW_DUPLICATES)
+
+        self.assertEqual(self.project.documents.count(), 4)
+        self.assertEqual(importer.rows_duplicated, 0)
+
+    def test_skip_duplicates(self):
+        importer = self.import_entries(ImportJob.SKIP_DUPLICATES)
+
+        self.assertEqual(sorted(self.project.documents.values_list('text', flat=True)), ['Alice', 'Bob'])
+        self.assertEqual(importer.rows_duplicated, 2)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.metadata, '{}')
+
+    def test_update_duplicates(self):
+        self.import_entries(ImportJob.UPDATE_DUPLICATES)
+
+        self.assertEqual(self.project.documents.count(), 2)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.metadata, '{"id": 1}')
+        self.assertEqual(self.project.documents.get(text='Bob').metadata, '{"id": 3}')
+
+    def test_other_projects_are_ignored(self):
+        project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING)
+        DocumentImporter(project, self.user, duplicates=ImportJob.SKIP_DUPLICATES) \
+            .import_entries([{'text': 'Alice'}])
+
+        self.assertEqual(project.documents.count(), 1)
+
+    def test_backfill_content_hash(self):
+        Document.objects.update(content_hash='')
+        call_command('backfill_content_hash', '--chunk_size', '1', stdout=io.StringIO())
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.content_hash, get_content_hash('Alice'))
+
+
+class TestTableParsers(TestCase):
+
+    def test_csv_with_header(self):
+        file = io.BytesIO('text,labels,external_id\nAlice,"[[0, 5, \'PERSON\']]",1\nBob,,2\n'.encode('utf-8'))
+        entries = list(csv_to_dicts(file))
+
+        self.assertEqual(entries, [{'text': 'Alice', 'labels': "[[0, 5, 'PERSON']]", 'external_id': '1'},
+                                   {'text': 'Bob', 'external_id': '2'}])
+
+    def test_csv_with_byte_order_mark(self):
+        file = io.BytesIO('text,external_id\n"Alice\nand Bob",1\n'.encode('utf-8-sig'))
+
+        self.assertEqual(list(csv_to_dicts(file)), [{'text': 'Alice\nand Bob', 'external_id': '1'}])
+
+    def test_csv_with_single_column(self):
+        file = io.BytesIO('AAA\nBBB\n'.encode('utf-8'))
+
+        self.assertEqual(list(csv_to_dicts(file)), [{'text': 'AAA'}, {'text': 'BBB'}])
+
+    def test_csv_without_text_column(self):
+        file = io.BytesIO('a,b\n1,2\n'.encode('utf-8'))
+
+        with self.assertRaises(ImportFileError):
+            list(csv_to_dicts(file))
+
+    def test_xlsx(self):
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append(['text', 'labels'])
+        worksheet.append(['Alice', "[[0, 5, 'PERSON']]"])
+        worksheet.append([42, None])
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+
+        self.assertEqual(list(xlsx_to_dicts(file)), [{'text': 'Alice', 'labels': "[[0, 5, 'PERSON']]"},
+                                                     {'text': '42'}])
+
+    def test_xlsx_with_dates(self):
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append(['text', 'created_at'])
+        worksheet.append(['Alice', datetime.datetime(2019, 3, 1)])
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+        entries = list(xlsx_to_dicts(file))
+
+        self.assertEqual(entries, [{'text': 'Alice', 'created_at': '2019-03-01T00:00:00'}])
+        user = User.objects.create_user(username='user', password='pass')
+        project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION)
+        DocumentImporter(project, user).import_entries(entries)
+        self.assertEqual(Document.objects.get().metadata, '{"created_at": "2019-03-01T00:00:00"}')
+
+
+class TestLabelDecoder(TestCase):
+
+    def setUp(self):
+        self.label_dict = {'PERSON': 1, 'LOC': 2}
+        self.decoder = LabelDecoder(Project.SEQUENCE_LABELING, self.label_dict)
+
+    def test_decode_span_strings(self):
+        raw_labels = ["[[0, 5, 'PERSON']]", '[[6, 11, "LOC"]]', "[(0, 5, 'PERSON')]", [[0, 5, 'LOC']], None]
+        labels, errors = self.decoder.decode_batch(['Alice Tokyo'] * 5, raw_labels)
+
+        self.assertEqual(labels, [[(0, 5, 1)], [(6, 11, 2)], [(0, 5, 1)], [(0, 5, 2)], []])
+        self.assertEqual(errors, [])
+
+    def test_report_invalid_spans(self):
+        raw_labels = ["[[0, 50, 'PERSON'], [0, 5, 'PERSON']]", "[[3, 1, 'LOC']]", "[[0, 1, 'ORG']]", '[[0, 1]]']
+        labels, errors = self.decoder.decode_batch(['Alice'] * 4, raw_labels)
+
+        self.assertEqual(labels, [[(0, 5, 1)], [], [], []])
+        self.assertEqual([index for index, _ in errors], [0, 1, 2, 3])
+
+    def test_labels_are_never_evaluated(self):
+        labels, errors = self.decoder.decode_batch(['Alice'], ["__import__('os').getcwd()"])
+
+        self.assertEqual(labels, [[]])
+        self.assertEqual(errors, [(0, 'could not parse labels (malformed value)')])
+
+    def test_decode_classification_labels(self):
+        decoder = LabelDecoder(Project.DOCUMENT_CLASSIFICATION, self.label_dict)
+        labels, errors = decoder.decode_batch(['Alice'], ["['PERSON', 'ORG']"])
+
+        self.assertEqual(labels, [[1]])
+        self.assertEqual(errors, [(0, "unknown label 'ORG'")])
+
+
+class TestParallelParsing(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user', password='pass')
+        cls.project = mixer.blend('server.Project', project_type=Project.SEQUENCE_LABELING)
+        cls.label = mixer.blend('server.Label', project=cls.project, text='PERSON')
+
+    def write_jsonl(self, count):
+        file_path = os.path.join(tempfile.mkdtemp(), 'upload.jsonl')
+        with open(file_path, 'w') as f:
+            for i in range(count):
+                labels = [[0, 5, 'PERSON']] if i % 2 else [[0, 5, 'ORG']]
+                f.write(json.dumps({'text': 'Alice {}'.format(i), 'labels': labels}) + '\n')
+
+        return file_path
+
+    def test_split_file_on_line_boundaries(self):
+        file_path = self.write_jsonl(50)
+        ranges = split_file(file_path, chunk_bytes=100)
+
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(file_path))
+        with open(file_path, 'rb') as f:
+            for start, end in ranges:
+                f.seek(end - 1)
+                self.assertEqual(f.read(1), b'\n')
+
+    def test_chunks_are_yielded_in_order(self):
+        file_path = self.write_jsonl(50)
+        decoder = LabelDecoder(Project.SEQUENCE_LABELING, {'PERSON': self.label.id})
+        chunks = list(parse_jsonl_parallel(file_path, decoder, workers=2, chunk_bytes=100))
+
+        rows = [row for chunk_rows, _ in chunks for row in chunk_rows]
+        self.assertEqual([text for text, _, _ in rows], ['Alice {}'.format(i) for i in range(50)])
+
+    @override_settings(IMPORT_PARSE_WORKERS=2, IMPORT_PARALLEL_MIN_BYTES=0, IMPORT_BATCH_SIZE=7)
+    def test_parallel_import_job(self):
+        job = ImportJob.objects.create(project=self.project, user=self.user,
+                                       file_path=self.write_jsonl(20), file_format='jsonl')
+        job = run_import_job(job)
+
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.rows_inserted, 20)
+        self.assertEqual(SequenceAnnotation.objects.count(), 10)
+        self.assertEqual(json.loads(job.errors)[:2], ["Row 1: unknown label 'ORG'", "Row 3: unknown label 'ORG'"])
@@ -1,8 +1,16 @@
+from datetime import timedelta
+from io import StringIO
 from django.test import TestCase
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from mixer.backend.django import mixer
-from ..models import Label, DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation
+from ..importers import DocumentImporter
+from ..models import Label, DocumentAnnotation, SequenceAnnotation, Seq2seqAnnotation, AnnotationCounter, \
+    DocumentCompletion, WorkItem
 
 
 class TestProject(TestCase):
@@ -17,6 +25,20 @@ class TestProject(TestCase):
         self.assertEqual(res['total'], 0)
         self.assertEqual(res['remaining'], 0)
 
+    def test_get_progress_per_user(self):
+        project = mixer.blend('server.Project', project_type='SequenceLabeling')
+        docs = mixer.cycle(3).blend('server.Document', project=project)
+        user, other = mixer.cycle(2).blend('auth.User')
+        label = mixer.blend('server.Label', project=project)
+        for start in range(2):
+            mixer.blend('server.SequenceAnnotation', document=docs[0], user=user, label=label,
+                        start_offset=start, end_offset=start + 1)
+        mixer.blend('server.SequenceAnnotation', document=docs[1], user=other, label=label,
+                    start_offset=0, end_offset=1)
+
+        self.assertEqual(project.get_progress(user), {'total': 3, 'remaining': 2})
+        self.assertEqual(project.get_progress(other), {'total': 3, 'remaining': 2})
+
 
 class TestLabel(TestCase):
 
@@ -70,3 +92,154 @@ class TestSeq2seqAnnotation(TestCase):
             Seq2seqAnnotation(document=a.document,
                               user=a.user,
                               text=a.text).save()
+
+
+class TestAnnotationCounter(TestCase):
+
+    def setUp(self):
+        self.project = mixer.blend('server.Project', project_type='DocumentClassification')
+        self.doc = mixer.blend('server.Document', project=self.project)
+        self.positive = mixer.blend('server.Label', project=self.project)
+        self.negative = mixer.blend('server.Label', project=self.project)
+        self.user = mixer.blend('auth.User')
+
+    def get_counts(self):
+        counters = AnnotationCounter.objects.filter(project=self.project).exclude(count=0)
+        return dict(((label, user), count) for label, user, count in counters.values_list('label', 'user', 'count'))
+
+    def test_create_and_delete(self):
+        a = DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=self.positive)
+        mixer.blend('server.DocumentAnnotation', label=self.positive, user=self.user,
+                    document=mixer.blend('server.Document', project=self.project))
+        self.assertEqual(self.get_counts(), {(self.positive.id, self.user.id): 2})
+
+        a.delete()
+        self.assertEqual(self.get_counts(), {(self.positive.id, self.user.id): 1})
+
+    def test_update_moves_count(self):
+        a = DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=self.positive)
+        a = DocumentAnnotation.objects.get(pk=a.pk)
+        a.label = self.negative
+        a.save()
+
+        self.assertEqual(self.get_counts(), {(self.negative.id, self.user.id): 1})
+
+    def test_cascades(self):
+        DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=self.positive)
+        DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=self.negative)
+        self.negative.delete()
+        self.assertEqual(self.get_counts(), {(self.positive.id, self.user.id): 1})
+
+        self.doc.delete()
+        self.assertEqual(self.get_counts(), {})
+
+    def test_project_delete_cascades_in_bulk(self):
+        def count_delete_queries(documents):
+            project = mixer.blend('server.Project', project_type='DocumentClassification')
+            label = mixer.blend('server.Label', project=project)
+            for document in mixer.cycle(documents).blend('server.Document', project=project):
+                DocumentAnnotation.objects.create(document=document, user=self.user, label=label)
+            with CaptureQueriesContext(connection) as queries:
+                project.delete()
+            return len(queries)
+
+        self.assertEqual(count_delete_queries(2), count_delete_queries(10))
+
+    def test_unlabeled_counters_are_unique(self):
+        project = mixer.blend('server.Project', project_type='Seq2seq')
+        AnnotationCounter.objects.create(project=project, label=None, user=self.user)
+        with self.assertRaises(IntegrityError):
+            AnnotationCounter.objects.create(project=project, label=None, user=self.user)
+
+    def test_recount(self):
+        DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=self.positive)
+        AnnotationCounter.objects.all().delete()
+
+        call_command('recount', '--project', str(self.project.id), stdout=StringIO())
+
+        self.assertEqual(self.get_counts(), {(self.positive.id, self.user.id): 1})
+
+
+class TestDocumentCompletion(TestCase):
+
+    def setUp(self):
+        self.project = mixer.blend('server.Project', project_type='DocumentClassification')
+        self.doc = mixer.blend('server.Document', project=self.project)
+        self.labels = mixer.cycle(2).blend('server.Label', project=self.project)
+        self.user = mixer.blend('auth.User')
+
+    def test_completed_until_last_annotation_is_deleted(self):
+        a, b = [DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=label)
+                for label in self.labels]
+        self.assertEqual(DocumentCompletion.objects.get(document=self.doc, user=self.user).annotations, 2)
+
+        a.delete()
+        self.assertTrue(DocumentCompletion.objects.filter(document=self.doc, user=self.user).exists())
+        b.delete()
+        self.assertFalse(DocumentCompletion.objects.filter(document=self.doc, user=self.user).exists())
+
+    def test_label_delete_removes_its_annotations(self):
+        other = mixer.blend('server.Document', project=self.project)
+        for label in self.labels:
+            DocumentAnnotation.objects.create(document=self.doc, user=self.user, label=label)
+        DocumentAnnotation.objects.create(document=other, user=self.user, label=self.labels[0])
+
+        self.labels[0].delete()
+        self.assertEqual(DocumentCompletion.objects.get(document=self.doc, user=self.user).annotations, 1)
+        self.assertFalse(DocumentCompletion.objects.filter(document=other).exists())
+        self.assertTrue(WorkItem.objects.filter(document=other).exists())
+        self.assertFalse(WorkItem.objects.filter(document=self.doc).exists())
+
+    def test_import_completes_documents(self):
+        label = self.labels[0]
+        DocumentImporter(self.project, self.user).import_entries([{'text': 'a', 'labels': [label.text]},
+                                                                  {'text': 'b', 'labels': []}])
+
+        self.assertEqual(self.project.get_progress(self.user), {'total': 3, 'remaining': 2})
+
+
+class TestWorkItem(TestCase):
+
+    def setUp(self):
+        self.project = mixer.blend('server.Project', project_type='DocumentClassification')
+        self.docs = mixer.cycle(3).blend('server.Document', project=self.project)
+        self.label = mixer.blend('server.Label', project=self.project)
+        self.users = mixer.cycle(2).blend('auth.User')
+
+    def test_leases_are_exclusive_and_renewed(self):
+        _, first = WorkItem.lease(self.project, self.users[0], 2)
+        _, second = WorkItem.lease(self.project, self.users[1], 2)
+        self.assertEqual(first, [self.docs[0].id, self.docs[1].id])
+        self.assertEqual(second, [self.docs[2].id])
+        self.assertEqual(WorkItem.lease(self.project, self.users[0], 2)[1], first)
+
+    def test_expired_leases_are_reclaimed(self):
+        WorkItem.lease(self.project, self.users[0], 3)
+        WorkItem.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(len(WorkItem.lease(self.project, self.users[1], 3)[1]), 3)
+        self.assertEqual(WorkItem.lease(self.project, self.users[0], 3)[1], [])
+
+    def test_annotated_documents_leave_the_queue(self):
+        annotation = DocumentAnnotation.objects.create(document=self.docs[0], user=self.users[0], label=self.label)
+        self.assertFalse(WorkItem.objects.filter(document=self.docs[0]).exists())
+
+        annotation.delete()
+        self.assertTrue(WorkItem.objects.filter(document=self.docs[0]).exists())
+
+    def test_annotations_of_completed_documents_leave_the_queue_alone(self):
+        DocumentAnnotation.objects.create(document=self.docs[0], user=self.users[0], label=self.label)
+        other = mixer.blend('server.Label', project=self.project)
+        with CaptureQueriesContext(connection) as queries:
+            DocumentAnnotation.objects.create(document=self.docs[0], user=self.users[0], label=other)
+        self.assertFalse([query for query in queries if 'server_workitem' in query['sql']])
+
+    def test_queue_twice(self):
+        WorkItem.queue(self.project.id, self.docs[0].id)
+        self.assertEqual(WorkItem.objects.filter(document=self.docs[0]).count(), 1)
+
+    def test_import_queues_unlabeled_documents(self):
+        DocumentImporter(self.project, self.users[0]).import_entries([{'text': 'a', 'labels': [self.label.text]},
+                                                                      {'text': 'b', 'labels': []}])
+
+        self.assertEqual(WorkItem.objects.filter(project=self.project).count(), 4)
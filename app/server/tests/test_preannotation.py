@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from mixer.backend.django import mixer
+
+from ..models import AnnotationCounter, ClassifierCheckpoint, DocumentAnnotation, Project, WorkItem
+from ..preannotation import PreannotationError, preannotate
+
+
+class ProjectDataMixin(object):
+
+    def setUp(self):
+        self.user = mixer.blend('auth.User')
+        self.project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION, users=[self.user])
+        self.positive, self.negative = mixer.cycle(2).blend('server.Label', project=self.project)
+        for text, label in [('good great nice', self.positive), ('great film', self.positive),
+                            ('nice good day', self.positive), ('bad awful terrible', self.negative),
+                            ('awful film', self.negative), ('terrible bad day', self.negative)]:
+            document = mixer.blend('server.Document', project=self.project, text=text)
+            mixer.blend('server.DocumentAnnotation', document=document, user=self.user, label=label)
+        self.unlabeled = [mixer.blend('server.Document', project=self.project, text=text)
+                          for text in ('a great and nice story', 'an awful and terrible story')]
+
+
+class TestPreannotation(ProjectDataMixin, TestCase):
+
+    def test_suggests_labels_for_unlabeled_documents(self):
+        self.assertEqual(preannotate(self.project, self.user, batch_size=1), 2)
+
+        suggestions = DocumentAnnotation.objects.filter(manual=False).order_by('document')
+        self.assertEqual([(a.document, a.label) for a in suggestions],
+                         [(self.unlabeled[0], self.positive), (self.unlabeled[1], self.negative)])
+        self.assertTrue(all(0.5 < a.prob <= 1 for a in suggestions))
+        self.assertEqual(AnnotationCounter.objects.get(project=self.project, label=self.positive).count, 4)
+
+    def test_suggestions_are_left_for_review(self):
+        preannotate(self.project, self.user)
+
+        self.assertEqual(self.project.get_progress(self.user)['remaining'], 2)
+        self.assertEqual(WorkItem.objects.filter(project=self.project).count(), 2)
+        self.assertEqual(preannotate(self.project, self.user), 0)
+
+    def test_suggestions_are_scored_again(self):
+        preannotate(self.project, self.user)
+        suggestion = DocumentAnnotation.objects.get(document=self.unlabeled[0], manual=False)
+        for text in ('a great story', 'a nice story', 'a good story'):
+            document = mixer.blend('server.Document', project=self.project, text=text)
+            mixer.blend('server.DocumentAnnotation', document=document, user=self.user, label=self.negative)
+
+        self.assertEqual(preannotate(self.project, self.user), 1)
+        relabeled = DocumentAnnotation.objects.get(document=self.unlabeled[0], manual=False)
+        self.assertEqual((relabeled.label, DocumentAnnotation.objects.filter(id=suggestion.id).exists()),
+                         (self.negative, False))
+        self.assertEqual(DocumentAnnotation.objects.filter(manual=False).count(), 2)
+        self.assertEqual(AnnotationCounter.objects.get(project=self.project, label=self.positive).count, 3)
+
+    def test_needs_two_trained_labels(self):
+        DocumentAnnotation.objects.filter(label=self.negative).first().delete()
+
+        with self.assertRaises(PreannotationError):
+            preannotate(self.project, self.user)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('preannotate', project=self.project.id, user=self.user.username, stdout=out)
+
+        self.assertIn('2 documents pre-annotated', out.getvalue())
+
+
+class TestIncrementalPreannotation(ProjectDataMixin, TestCase):
+
+    def setUp(self):
+        super(TestIncrementalPreannotation, self).setUp()
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(CLASSIFIER_CHECKPOINT_DIR=self.checkpoint_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.checkpoint_dir)
+
+    def test_trains_on_new_annotations_only(self):
+        self.assertEqual(preannotate(self.project, self.user, incremental=True), 2)
+        checkpoint = ClassifierCheckpoint.objects.get(project=self.project)
+        self.assertEqual(checkpoint.annotations_trained, 6)
+        self.assertTrue(os.path.exists(checkpoint.file_path))
+
+        document = mixer.blend('server.Document', project=self.project, text='great')
+        annotation = mixer.blend('server.DocumentAnnotation', document=document, user=self.user, label=self.positive)
+        preannotate(self.project, self.user, batch_size=1, incremental=True)
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.annotations_trained, 7)
+        self.assertGreaterEqual(checkpoint.trained_until, annotation.updated_at)
+
+    def test_trains_on_confirmed_suggestions(self):
+        preannotate(self.project, self.user, incremental=True)
+        suggestion = DocumentAnnotation.objects.get(document=self.unlabeled[0], manual=False)
+        suggestion.manual = True
+        suggestion.save()
+
+        self.assertEqual(preannotate(self.project, self.user, incremental=True), 0)
+        self.assertEqual(ClassifierCheckpoint.objects.get(project=self.project).annotations_trained, 7)
+
+    def test_new_labels_retrain_from_scratch(self):
+        preannotate(self.project, self.user, incremental=True)
+        mixer.blend('server.Label', project=self.project)
+        preannotate(self.project, self.user, incremental=True)
+
+        self.assertEqual(ClassifierCheckpoint.objects.get(project=self.project).annotations_trained, 6)
+
+    def test_needs_two_trained_labels(self):
+        DocumentAnnotation.objects.filter(label=self.negative).first().delete()
+
+        with self.assertRaises(PreannotationError):
+            preannotate(self.project, self.user, incremental=True)
+        self.assertFalse(DocumentAnnotation.objects.filter(manual=False).exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('preannotate', project=self.project.id, user=self.user.username, incremental=True, stdout=out)
+
+        self.assertIn('2 documents pre-annotated', out.getvalue())
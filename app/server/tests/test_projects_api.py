@@ -46,6 +46,22 @@ class TestProjects(APITestCase):
         self.assertIsInstance(response.data['total'], int)
         self.assertIsInstance(response.data['remaining'], int)
 
+    def test_get_progress_of_all_projects(self):
+        """
+        Ensure user can get the progress of all their projects at once.
+        """
+        self.client.login(username=self.super_username, password=self.password)
+        docs = mixer.cycle(3).blend('server.Document', project=self.project1)
+        mixer.blend('server.DocumentAnnotation', document=docs[0], user=self.super_user,
+                    label=mixer.blend('server.Label', project=self.project1))
+        url = '{}progress/'.format(self.url)
+        with self.assertNumQueries(5):
+            response = self.client.get(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {self.project1.id: {'total': 3, 'remaining': 2},
+                                         self.project2.id: {'total': 0, 'remaining': 0}})
+
     def test_superuser_can_delete_project(self):
         """
         Ensure superuser can delete a project.
@@ -66,3 +82,37 @@ class TestProjects(APITestCase):
         response = self.client.delete(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertEqual(Project.objects.count(), 2)
+
+
+class TestProjectMembership(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username, cls.password = 'user', 'pass'
+        cls.user = User.objects.create_user(username=cls.username, password=cls.password)
+        cls.project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION, users=[cls.user])
+        cls.url = reverse('labels', args=[cls.project.id])
+
+    def setUp(self):
+        self.client.login(username=self.username, password=self.password)
+
+    def test_membership_is_checked_once(self):
+        """
+        Ensure the project and membership take one query each per request.
+        """
+        with self.assertNumQueries(5):
+            self.client.get(self.url, format='json')
+        with self.assertNumQueries(5):
+            self.client.get(self.url, format='json')
+
+    def test_membership_changes_are_seen(self):
+        """
+        Ensure the next request sees the changes of project members.
+        """
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_200_OK)
+        self.project.users.remove(self.user)
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_403_FORBIDDEN)
+        self.user.projects.add(self.project)
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_200_OK)
+        self.user.projects.clear()
+        self.assertEqual(self.client.get(self.url, format='json').status_code, status.HTTP_403_FORBIDDEN)
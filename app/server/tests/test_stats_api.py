@@ -0,0 +1,68 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from mixer.backend.django import mixer
+from ..models import User, Project
+
+
+class TestStatsAPI(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.username, cls.password = 'user', 'pass'
+        cls.user = User.objects.create_superuser(username=cls.username, password=cls.password,
+                                                 email='fizz@buzz.com')
+        cls.other = mixer.blend('auth.User', username='other')
+        cls.project = mixer.blend('server.Project', project_type=Project.DOCUMENT_CLASSIFICATION,
+                                  users=[cls.user, cls.other])
+        cls.positive = mixer.blend('server.Label', project=cls.project, text='positive')
+        cls.negative = mixer.blend('server.Label', project=cls.project, text='negative')
+        for i in range(3):
+            doc = mixer.blend('server.Document', project=cls.project)
+            mixer.blend('server.DocumentAnnotation', document=doc, user=cls.user, label=cls.positive)
+        mixer.blend('server.DocumentAnnotation', document=doc, user=cls.other, label=cls.positive)
+        mixer.blend('server.DocumentAnnotation', document=doc, user=cls.other, label=cls.negative)
+        cls.url = reverse('stats-api', args=[cls.project.id])
+
+    def test_counts(self):
+        """
+        Ensure labels and users are counted per project.
+        """
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(self.url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        label = dict(zip(response.data['label']['labels'], response.data['label']['data']))
+        user = dict(zip(response.data['user']['users'], response.data['user']['data']))
+        self.assertEqual(label, {'positive': 4, 'negative': 1})
+        self.assertEqual(user, {self.username: 3, 'other': 2})
+
+    def test_seq2seq_counts(self):
+        """
+        Ensure seq2seq projects, which have no labels, count users only.
+        """
+        project = mixer.blend('server.Project', project_type=Project.Seq2seq, users=[self.user])
+        mixer.blend('server.Seq2seqAnnotation', document=mixer.blend('server.Document', project=project),
+                    user=self.user)
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.get(reverse('stats-api', args=[project.id]), format='json')
+
+        self.assertEqual(response.data, {'label': {'labels': [], 'data': []},
+                                         'user': {'users': [self.username], 'data': [1]}})
+
+    def test_queries_do_not_grow_with_documents(self):
+        """
+        Ensure the number of queries does not depend on the number of documents.
+        """
+        self.client.login(username=self.username, password=self.password)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(self.url, format='json')
+        for i in range(10):
+            doc = mixer.blend('server.Document', project=self.project)
+            mixer.blend('server.DocumentAnnotation', document=doc, user=self.user, label=self.negative)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(self.url, format='json')
+
+        self.assertEqual(len(before), len(after))
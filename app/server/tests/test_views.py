@@ -1,11 +1,16 @@
 import os
+import tempfile
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.urls import reverse
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from rest_framework import status
 from mixer.backend.django import mixer
-from ..models import User, Document
+from ..models import User, Document, ImportJob
 
 
+@override_settings(IMPORT_STAGING_DIR=tempfile.mkdtemp())
 class TestUpload(TestCase):
 
     def setUp(self):
@@ -42,6 +47,7 @@ class TestUpload(TestCase):
             url = reverse('upload', args=[project.id])
             self.client.login(username=self.username, password=self.password)
             response = self.client.post(url, {'file': f, 'format': 'csv'})
+        call_command('import_worker', '--once', stdout=StringIO())
 
         self.assertEqual(response.status_code, status.HTTP_302_FOUND)
         self.assertEqual(Document.objects.count(), 3)
@@ -74,6 +80,59 @@ class TestUpload(TestCase):
             url = reverse('upload', args=[project.id])
             self.client.login(username=self.username, password=self.password)
             response = self.client.post(url, {'file': f, 'format': 'json'})
+        call_command('import_worker', '--once', stdout=StringIO())
 
         self.assertEqual(response.status_code, status.HTTP_302_FOUND)
         self.assertEqual(Document.objects.count(), 18)
+
+    def test_upload_rejects_unsupported_format(self):
+        """
+        Ensure a file the import worker cannot parse is rejected at upload.
+        """
+        user = self.create_superuser()
+        project = self.create_project()
+        project.users.add(user)
+
+        url = reverse('upload', args=[project.id])
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.post(url, {'file': SimpleUploadedFile('data.pdf', b'text')})
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_ajax_upload_reports_errors(self):
+        """
+        Ensure an ajax upload that is rejected gets the error instead of a redirect.
+        """
+        user = self.create_superuser()
+        project = self.create_project()
+        project.users.add(user)
+
+        url = reverse('upload', args=[project.id])
+        self.client.login(username=self.username, password=self.password)
+        response = self.client.post(url, {'file': SimpleUploadedFile('data.pdf', b'text')},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'detail': 'Unsupported file format: pdf'})
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_upload_queues_import_job(self):
+        """
+        Ensure an ajax upload is queued and reports where to poll its progress.
+        """
+        user = self.create_superuser()
+        project = self.create_project()
+        project.users.add(user)
+
+        with open(self.json_path, 'r') as f:
+            url = reverse('upload', args=[project.id])
+            self.client.login(username=self.username, password=self.password)
+            response = self.client.post(url, {'file': f}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        job = ImportJob.objects.get()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['url'], reverse('import-job', args=[project.id, job.id]))
+        self.assertEqual(job.status, ImportJob.PENDING)
+        self.assertTrue(os.path.exists(job.file_path))
+        self.assertEqual(Document.objects.count(), 0)
@@ -6,7 +6,8 @@ from .views import ProjectView, DatasetView, DataUpload, LabelView, StatsView, G
 from .views import ProjectsView, DataDownload, DataDownloadFile
 from .views import DemoTextClassification, DemoNamedEntityRecognition, DemoTranslation
 from .api import ProjectViewSet, LabelList, ProjectStatsAPI, LabelDetail, \
-    AnnotationList, AnnotationDetail, DocumentList
+    AnnotationList, AnnotationDetail, DocumentList, DocumentQueue, DocumentWindow, ImportJobDetail, \
+    ChunkedUploadList, ChunkedUploadDetail, ChunkedUploadChunk, ChunkedUploadFinalize
 
 from . import views
 
@@ -20,8 +21,18 @@ urlpatterns = [
     path('api/projects/<int:project_id>/labels/', LabelList.as_view(), name='labels'),
     path('api/projects/<int:project_id>/labels/<int:label_id>', LabelDetail.as_view(), name='label'),
     path('api/projects/<int:project_id>/docs/', DocumentList.as_view(), name='docs'),
+    path('api/projects/<int:project_id>/docs/next/', DocumentQueue.as_view(), name='next-docs'),
+    path('api/projects/<int:project_id>/docs/window/', DocumentWindow.as_view(), name='doc-window'),
     path('api/projects/<int:project_id>/docs/<int:doc_id>/annotations/', AnnotationList.as_view(), name='annotations'),
     path('api/projects/<int:project_id>/docs/<int:doc_id>/annotations/<int:annotation_id>', AnnotationDetail.as_view(), name='ann'),
+    path('api/projects/<int:project_id>/imports/<int:job_id>/', ImportJobDetail.as_view(), name='import-job'),
+    path('api/projects/<int:project_id>/uploads/', ChunkedUploadList.as_view(), name='chunked-uploads'),
+    path('api/projects/<int:project_id>/uploads/<int:upload_id>/', ChunkedUploadDetail.as_view(),
+         name='chunked-upload'),
+    path('api/projects/<int:project_id>/uploads/<int:upload_id>/chunks/<int:index>', ChunkedUploadChunk.as_view(),
+         name='chunked-upload-chunk'),
+    path('api/projects/<int:project_id>/uploads/<int:upload_id>/finalize/', ChunkedUploadFinalize.as_view(),
+         name='chunked-upload-finalize'),
     path('projects/', ProjectsView.as_view(), name='projects'),
     path('projects/<int:project_id>/download', DataDownload.as_view(), name='download'),
     path('projects/<int:project_id>/download_file', DataDownloadFile.as_view(), name='download_file'),
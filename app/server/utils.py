@@ -1,5 +1,9 @@
+import hashlib
+import itertools as it
+import re
 import string
 
+
 def get_key_choices():
     selectKey, shortKey = [c for c in string.ascii_lowercase], [c for c in string.ascii_lowercase]
     checkKey = 'ctrl shift'
@@ -8,3 +12,47 @@ def get_key_choices():
     shortKey += ['']
     KEY_CHOICES = ((u, c) for u, c in zip(shortKey, shortKey))
     return KEY_CHOICES
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(it.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def parse_range_header(header, size):
+    """Returns the ``(start, end)`` of a single ``bytes`` range, end included.
+
+    Returns None when the header should be ignored and the whole file sent,
+    and raises ValueError when the range cannot be satisfied.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError('Unsatisfiable range: {}'.format(header))
+    return start, end
+
+
+def read_file_range(file, start, length, block_size=64 * 1024):
+    """Yields length bytes of an open file from start, closing it at the end."""
+    with file:
+        file.seek(start)
+        while length > 0:
+            block = file.read(min(block_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
@@ -6,4 +6,6 @@ if [[ ! -d "app/staticfiles" ]]; then python app/manage.py collectstatic --noinp
 
 python app/manage.py wait_for_db
 python app/manage.py migrate
+python app/manage.py import_worker &
+python app/manage.py refresh_exports &
 gunicorn --bind="0.0.0.0:${PORT:-8000}" --workers="${WORKERS:-1}" --pythonpath=app app.wsgi